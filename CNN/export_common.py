@@ -0,0 +1,261 @@
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+from sklearn.utils import resample
+from tensorflow import keras
+from tensorflow.keras import layers
+from tensorflow.keras.applications import EfficientNetV2M
+
+
+IMG_WIDTH = (260, 260)
+IMG_CHANNELS = 3
+RANDOM_SEED = 42
+CROP = True
+COEF_FOTO = 15
+# Пороги сервера (site/main.py, classify): ниже первого - доброкачественное, не ниже второго - злокачественное
+THRESHOLDS = (0.266, 0.316)
+
+ISIC_2024_meta_path = "/mnt/a/Datasets/ISIC_2024_Training_Input/ISIC_2024_Training_GroundTruth.csv"
+ISIC_2024_image_dir = "/mnt/a/Datasets/processed_data/isic_2024_data" + ("_crop3" if CROP else "")
+
+ISIC_2020_meta_path = "/mnt/a/Datasets/ISIC_2020_Training_JPEG/ISIC_2020_Training_GroundTruth_v2.csv"
+ISIC_2020_image_dir = "/mnt/a/Datasets/processed_data/isic_2020_data" + ("_crop3" if CROP else "")
+
+
+def del_big_data(df):
+    df_majority = df[df['label'] == 0]
+    df_minority = df[df['label'] == 1]
+    n_benign_target = min(len(df_majority), len(df_minority) * COEF_FOTO)
+
+    df_majority_downsampled = resample(df_majority,
+                                        replace=False,
+                                        n_samples=n_benign_target,
+                                        random_state=RANDOM_SEED)
+
+    df_balanced = pd.concat([df_majority_downsampled, df_minority])
+    return df_balanced.reset_index(drop=True)
+
+
+def load_manifest():
+    # Тот же состав датасетов и то же разбиение, что в "Нейросеть на EfficientNetV2M copy.py":
+    # калибруемся только на обучающей выборке, метрики считаем на валидационной
+    all_filepaths = []
+    all_labels = []
+
+    df1 = pd.read_csv(ISIC_2024_meta_path)
+    df1['filepath'] = df1['isic_id'].apply(lambda x: ISIC_2024_image_dir + "/" + x + '.jpg')
+    df1['label'] = df1['malignant'].astype(int)
+    df1 = del_big_data(df1)
+    all_filepaths.extend(df1['filepath'].tolist())
+    all_labels.extend(df1['label'].tolist())
+
+    df1 = pd.read_csv(ISIC_2020_meta_path)
+    df1['filepath'] = df1['image_name'].apply(lambda x: ISIC_2020_image_dir + "/" + x + '.jpg')
+    df1['label'] = df1['target'].astype(int)
+    df1 = del_big_data(df1)
+    all_filepaths.extend(df1['filepath'].tolist())
+    all_labels.extend(df1['label'].tolist())
+
+    return train_test_split(
+        all_filepaths,
+        all_labels,
+        test_size=0.2,
+        random_state=RANDOM_SEED,
+        stratify=all_labels
+    )
+
+
+def build_model(weights_path):
+    input_tensor = keras.Input(shape=(IMG_WIDTH[0], IMG_WIDTH[1], IMG_CHANNELS), name='image_input')
+    base_model = EfficientNetV2M(weights=None, include_top=False, input_tensor=input_tensor)
+
+    x = base_model.output
+    x = layers.GlobalAveragePooling2D(name='global_avg_pool')(x)
+    x = layers.Dropout(0.2, name='head_dropout')(x)
+    output_tensor = layers.Dense(1, activation='sigmoid', name='class_predictions')(x)
+
+    model = keras.Model(inputs=input_tensor, outputs=output_tensor)
+    model.load_weights(weights_path)
+    return model
+
+
+def to_model_input(images):
+    # Как normalize при обучении. preprocess_input у EfficientNetV2 ничего не делает, нормализация внутри модели
+    return tf.keras.applications.efficientnet_v2.preprocess_input(tf.cast(images, tf.float32))
+
+
+def build_pixel_model(model):
+    # Единственный входной контракт серверной модели для всех экспортов (TFLite, ONNX):
+    # uint8-батч 260x260. Центральный квадрат и ресайз делает сервер (site/inference.py, decode_image)
+    raw_input = keras.Input(shape=(IMG_WIDTH[0], IMG_WIDTH[1], IMG_CHANNELS), dtype="uint8", name="raw_image")
+    images = layers.Lambda(to_model_input, name="preprocess")(raw_input)
+    return keras.Model(inputs=raw_input, outputs=model(images))
+
+
+def load_image(path):
+    # Как load_and_preprocess_image при обучении: центральный квадрат, ресайз, uint8
+    image = tf.io.decode_image(tf.io.read_file(path), channels=IMG_CHANNELS, expand_animations=False)
+    shape = tf.shape(image)
+    side = tf.minimum(shape[0], shape[1])
+    image = tf.image.crop_to_bounding_box(image, (shape[0] - side) // 2, (shape[1] - side) // 2, side, side)
+    image = tf.image.resize(image, IMG_WIDTH)
+    return tf.cast(image, tf.uint8).numpy()
+
+
+def convert_tflite(pixel_model, variant, calibration_paths=()):
+    converter = tf.lite.TFLiteConverter.from_keras_model(pixel_model)
+    if variant == "float16":
+        # Веса хранятся во float16 и на CPU разворачиваются во float32 при загрузке:
+        # квантизация только весов, вычисления остаются float32
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "dynamic_range":
+        # Веса int8, активации квантуются на лету в каждом invoke()
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == "int8":
+        # Полностью целочисленная модель: веса и активации int8, вход остаётся сырым uint8,
+        # а выход - float-вероятностью, поэтому сервер работает с ней без изменений
+        def representative_dataset():
+            for path in calibration_paths:
+                yield [load_image(path)[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+    return converter.convert()
+
+
+def _set_input(interpreter, input_details, images):
+    if input_details["dtype"] == np.uint8:
+        interpreter.set_tensor(input_details["index"], images)
+        return
+    scale, zero_point = input_details["quantization"]
+    if input_details["dtype"] == np.float32 or not scale:
+        interpreter.set_tensor(input_details["index"], images.astype(input_details["dtype"]))
+        return
+    quantized = np.round(images / scale + zero_point)
+    info = np.iinfo(input_details["dtype"])
+    interpreter.set_tensor(input_details["index"], np.clip(quantized, info.min, info.max).astype(input_details["dtype"]))
+
+
+def _get_output(interpreter, output_details):
+    output = interpreter.get_tensor(output_details["index"])
+    scale, zero_point = output_details["quantization"]
+    if output_details["dtype"] != np.float32 and scale:
+        output = (output.astype(np.float32) - zero_point) * scale
+    return output[:, 0].astype(np.float32)
+
+
+def make_interpreter(model_content, num_threads=None, batch_size=1):
+    interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+    input_details = interpreter.get_input_details()[0]
+    interpreter.resize_tensor_input(input_details["index"], (batch_size, IMG_WIDTH[0], IMG_WIDTH[1], IMG_CHANNELS))
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def predict_tflite(model_content, images, batch_size=32, num_threads=None):
+    interpreter = make_interpreter(model_content, num_threads, batch_size)
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    predictions = []
+    for start in range(0, len(images), batch_size):
+        batch = np.asarray(images[start:start + batch_size])
+        if len(batch) != batch_size:
+            interpreter.resize_tensor_input(input_details["index"], batch.shape)
+            interpreter.allocate_tensors()
+        _set_input(interpreter, input_details, batch)
+        interpreter.invoke()
+        predictions.append(_get_output(interpreter, output_details))
+    return np.concatenate(predictions)
+
+
+def measure_latency(model_content, batch_size=1, num_threads=None, repeats=30, warmup=3):
+    # Медиана времени одного invoke() на случайном батче, в миллисекундах
+    interpreter = make_interpreter(model_content, num_threads, batch_size)
+    input_details = interpreter.get_input_details()[0]
+    images = np.random.default_rng(RANDOM_SEED).integers(
+        0, 256, (batch_size, IMG_WIDTH[0], IMG_WIDTH[1], IMG_CHANNELS), dtype=np.uint8
+    )
+    _set_input(interpreter, input_details, images)
+    for _ in range(warmup):
+        interpreter.invoke()
+    durations = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        interpreter.invoke()
+        durations.append(time.perf_counter() - started)
+    return float(np.median(durations) * 1000)
+
+
+_PEAK_MEMORY_CODE = """
+import sys
+import numpy as np
+import tensorflow as tf
+path, batch_size, num_threads = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) or None
+if path:
+    interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+    details = interpreter.get_input_details()[0]
+    interpreter.resize_tensor_input(details["index"], (batch_size, 260, 260, 3))
+    interpreter.allocate_tensors()
+    interpreter.set_tensor(details["index"], np.zeros((batch_size, 260, 260, 3), dtype=details["dtype"]))
+    interpreter.invoke()
+with open("/proc/self/status") as f:
+    print(next(line.split()[1] for line in f if line.startswith("VmHWM:")))
+"""
+
+
+def measure_peak_memory(model_path, batch_size=1, num_threads=None):
+    # Пиковый RSS отдельного процесса, который загружает модель и делает один invoke(),
+    # за вычетом такого же процесса без модели (сам tensorflow занимает сотни МБ), в МБ.
+    # ru_maxrss не годится: после fork+exec он наследует пик родителя
+    def peak_kb(path):
+        output = subprocess.run(
+            [sys.executable, "-c", _PEAK_MEMORY_CODE, path, str(batch_size), str(num_threads or 0)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return int(output.strip().splitlines()[-1])
+
+    return round((peak_kb(model_path) - peak_kb("")) / 1024, 1)
+
+
+def agreement(reference, predictions):
+    # Насколько вероятности и итоговые классы сервера (0/1/2 по THRESHOLDS) совпадают с эталоном
+    difference = np.abs(np.asarray(predictions) - np.asarray(reference))
+    return {
+        "max_abs_diff": float(difference.max()),
+        "mean_abs_diff": float(difference.mean()),
+        "class_agreement": float(np.mean(
+            np.digitize(predictions, THRESHOLDS) == np.digitize(reference, THRESHOLDS)
+        )),
+    }
+
+
+def threshold_metrics(labels, predictions, thresholds=THRESHOLDS):
+    # Чувствительность и специфичность, если считать положительным всё, что не ниже порога
+    labels = np.asarray(labels)
+    metrics = {}
+    for threshold in thresholds:
+        positive = np.asarray(predictions) >= threshold
+        tp = int(np.sum(positive & (labels == 1)))
+        fn = int(np.sum(~positive & (labels == 1)))
+        tn = int(np.sum(~positive & (labels == 0)))
+        fp = int(np.sum(positive & (labels == 0)))
+        metrics[str(threshold)] = {
+            "sensitivity": tp / (tp + fn) if tp + fn else None,
+            "specificity": tn / (tn + fp) if tn + fp else None,
+        }
+    return metrics
+
+
+def write_report(path, report):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчёт сохранён в {path}")
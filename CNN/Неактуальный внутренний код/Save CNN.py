@@ -1,3 +1,6 @@
+import os
+import sys
+
 import tensorflow as tf
 from tensorflow.keras.applications import EfficientNetV2M
 from tensorflow.keras.optimizers import AdamW
@@ -5,6 +8,10 @@ from tensorflow.keras import layers
 from tensorflow import keras
 import tensorflow.keras.backend as K
 import tensorflowjs as tfjs
+import tf2onnx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from export_common import build_pixel_model
 
 IMG_WIDTH = (260, 260)
 IMG_CHANNELS = 3
@@ -56,9 +63,21 @@ full_model_path = "/mnt/c/Users/urako/OneDrive/Документы/Code/Mr.-Mole/
 # model.save(full_model_path)
 print(f"Модель сохранена в {full_model_path}")
 
+# Та же обёртка, что в скриптах экспорта: uint8-батч 260x260, центральный квадрат и ресайз делает сервер
+serving_model = build_pixel_model(model)
+
 # Конвертация в TFLite
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
+converter = tf.lite.TFLiteConverter.from_keras_model(serving_model)
 tflite_model = converter.convert()
 
 with open("model.tflite", "wb") as f:
     f.write(tflite_model)
+
+# Та же модель в ONNX для серверных бэкендов ONNX Runtime и OpenVINO (OpenVINO читает ONNX напрямую).
+# Размер батча остаётся динамическим, как и у TFLite-модели
+tf2onnx.convert.from_keras(
+    serving_model,
+    input_signature=(tf.TensorSpec((None, IMG_WIDTH[0], IMG_WIDTH[1], IMG_CHANNELS), tf.uint8, name="raw_image"),),
+    opset=17,
+    output_path="model.onnx",
+)
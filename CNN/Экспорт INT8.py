@@ -0,0 +1,67 @@
+import argparse
+import os
+
+import numpy as np
+
+from export_common import (
+    RANDOM_SEED,
+    THRESHOLDS,
+    agreement,
+    build_model,
+    build_pixel_model,
+    convert_tflite,
+    load_image,
+    load_manifest,
+    measure_latency,
+    predict_tflite,
+    threshold_metrics,
+    write_report,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8-квантизация модели с калибровкой на обучающей выборке")
+    parser.add_argument("weights", help="Чекпоинт .weights.h5")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--calibration-samples", type=int, default=500)
+    parser.add_argument("--eval-limit", type=int, default=0, help="Сколько валидационных фото оценивать (0 - все)")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    train_paths, val_paths, train_labels, val_labels = load_manifest()
+    rng = np.random.default_rng(RANDOM_SEED)
+    calibration_paths = rng.choice(train_paths, size=min(args.calibration_samples, len(train_paths)), replace=False)
+    if args.eval_limit:
+        val_paths, val_labels = val_paths[:args.eval_limit], val_labels[:args.eval_limit]
+    print(f"Калибровка: {len(calibration_paths)} фото, оценка: {len(val_paths)} фото")
+
+    pixel_model = build_pixel_model(build_model(args.weights))
+    models = {
+        "float32": convert_tflite(pixel_model, "float32"),
+        "int8": convert_tflite(pixel_model, "int8", calibration_paths),
+    }
+
+    val_images = np.stack([load_image(path) for path in val_paths])
+    report = {"thresholds": list(THRESHOLDS), "calibration_samples": len(calibration_paths), "eval_samples": len(val_paths)}
+    predictions = {}
+    for name, model_content in models.items():
+        path = os.path.join(args.output_dir, f"model_{name}.tflite")
+        with open(path, "wb") as f:
+            f.write(model_content)
+        predictions[name] = predict_tflite(model_content, val_images, num_threads=args.threads)
+        report[name] = {
+            "path": path,
+            "size_mb": round(len(model_content) / 2**20, 2),
+            "latency_ms_batch1": round(measure_latency(model_content, 1, args.threads), 2),
+            "latency_ms_batch8": round(measure_latency(model_content, 8, args.threads), 2),
+            "metrics": threshold_metrics(val_labels, predictions[name]),
+        }
+        print(f"✅ {name}: {report[name]['size_mb']} МБ, {report[name]['latency_ms_batch1']} мс, {report[name]['metrics']}")
+
+    # Насколько int8 сдвигает вероятности и решения сервера относительно float-модели
+    report["int8_vs_float32"] = agreement(predictions["float32"], predictions["int8"])
+    write_report(os.path.join(args.output_dir, "int8_report.json"), report)
+
+
+if __name__ == "__main__":
+    main()
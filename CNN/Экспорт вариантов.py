@@ -0,0 +1,72 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from export_common import (
+    RANDOM_SEED,
+    agreement,
+    build_model,
+    build_pixel_model,
+    convert_tflite,
+    load_image,
+    load_manifest,
+    measure_latency,
+    measure_peak_memory,
+    predict_tflite,
+    write_report,
+)
+
+
+LATENCY_BATCH_SIZES = (1, 8, 32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт нескольких вариантов TFLite-модели и таблица задержек и точности")
+    parser.add_argument("weights", help="Чекпоинт .weights.h5")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--eval-limit", type=int, default=1000, help="Сколько валидационных фото сравнивать с Keras (0 - все)")
+    parser.add_argument("--calibration-samples", type=int, default=0, help="Калибровка для полного int8 (0 - без int8)")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    train_paths, val_paths, _, _ = load_manifest()
+    if args.eval_limit:
+        val_paths = val_paths[:args.eval_limit]
+    variants = ["float32", "float16", "dynamic_range"]
+    calibration_paths = ()
+    if args.calibration_samples:
+        rng = np.random.default_rng(RANDOM_SEED)
+        calibration_paths = rng.choice(train_paths, size=min(args.calibration_samples, len(train_paths)), replace=False)
+        variants.append("int8")
+
+    pixel_model = build_pixel_model(build_model(args.weights))
+    val_images = np.stack([load_image(path) for path in val_paths])
+    keras_predictions = pixel_model.predict(val_images, batch_size=32, verbose=0)[:, 0]
+
+    rows = []
+    for variant in variants:
+        model_content = convert_tflite(pixel_model, variant, calibration_paths)
+        path = os.path.join(args.output_dir, f"model_{variant}.tflite")
+        with open(path, "wb") as f:
+            f.write(model_content)
+
+        row = {"variant": variant, "path": path, "size_mb": round(len(model_content) / 2**20, 2)}
+        for batch_size in LATENCY_BATCH_SIZES:
+            row[f"latency_ms_b{batch_size}"] = round(measure_latency(model_content, batch_size, args.threads), 2)
+        row["peak_memory_mb_b1"] = measure_peak_memory(path, 1, args.threads)
+        row["peak_memory_mb_b32"] = measure_peak_memory(path, 32, args.threads)
+        row.update(agreement(keras_predictions, predict_tflite(model_content, val_images, num_threads=args.threads)))
+        rows.append(row)
+        print(f"✅ {variant}: {row}")
+
+    write_report(os.path.join(args.output_dir, "variants.json"), {"eval_samples": len(val_paths), "variants": rows})
+    with open(os.path.join(args.output_dir, "variants.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
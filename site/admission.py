@@ -0,0 +1,110 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi.responses import JSONResponse
+
+from metrics import SHED_REQUESTS
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Server is overloaded")
+        self.retry_after = retry_after
+
+
+class QueueDelayShedder:
+    # CoDel в варианте для очередей запросов: если за целый интервал время ожидания в очереди
+    # ни разу не опустилось ниже target, очередь стоячая, и всё, что прождало дольше target,
+    # отбрасывается сразу. Иначе короткий всплеск спокойно рассасывается, пока ожидание не дойдёт до interval
+    def __init__(self, target_ms: float, interval_ms: float):
+        self.target = target_ms / 1000
+        self.interval = interval_ms / 1000
+        self.overloaded = False
+        self._min_delay = math.inf
+        self._interval_end: float | None = None
+
+    def should_drop(self, delay: float, now: float) -> bool:
+        if self._interval_end is None:
+            self._interval_end = now + self.interval
+        if now >= self._interval_end:
+            self.overloaded = self._min_delay > self.target
+            self._min_delay = math.inf
+            self._interval_end = now + self.interval
+        self._min_delay = min(self._min_delay, delay)
+        return delay > (self.target if self.overloaded else self.interval)
+
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def acquire(self, client: str) -> float:
+        # 0, если запрос пропущен, иначе через сколько секунд появится следующий токен
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        # Самые давно не заходившие клиенты вытесняются, чтобы словарь не рос без предела
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionMiddleware:
+    def __init__(
+        self,
+        app,
+        paths: set[str],
+        overloaded: Callable[[], bool],
+        retry_after: float,
+        buckets: TokenBuckets | None = None,
+        client_header: str = "",
+    ):
+        self.app = app
+        self.paths = paths
+        self.overloaded = overloaded
+        self.retry_after = retry_after
+        self.buckets = buckets
+        self.client_header = client_header.lower().encode()
+
+    def client_id(self, scope) -> str:
+        if self.client_header:
+            for name, value in scope["headers"]:
+                if name == self.client_header:
+                    return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    async def __call__(self, scope, receive, send):
+        # Отказ до чтения тела: под нагрузкой лишний запрос должен стоить серверу как можно меньше
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            response = None
+            wait = self.buckets.acquire(self.client_id(scope)) if self.buckets is not None else 0
+            if wait:
+                SHED_REQUESTS.labels("rate_limit").inc()
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+            elif self.overloaded():
+                SHED_REQUESTS.labels("queue_full").inc()
+                response = JSONResponse(
+                    {"detail": "Server is overloaded"},
+                    status_code=503,
+                    headers={"Retry-After": str(math.ceil(self.retry_after))},
+                )
+            if response is not None:
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,193 @@
+import importlib.util
+import time
+from functools import partial
+from typing import Callable, Sequence
+
+import numpy as np
+
+import get_model
+from inference import INPUT_SHAPE, InferenceSession, bucket_size, fill_input
+from metrics import BATCH_SIZE, observe_stage
+
+
+class OnnxRuntimeSession:
+    def __init__(self, num_threads: int | None = None, buckets: Sequence[int] = ()):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or 0
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(get_model.ONNX_MODEL_PATH), options, providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        self.input_dtype = np.uint8 if model_input.type == "tensor(uint8)" else np.float32
+        self.buckets = sorted(buckets)
+        self._input_buffers: dict[int, np.ndarray] = {}
+
+    def predict(self, images: Sequence[np.ndarray], out: np.ndarray | None = None, record: bool = True) -> np.ndarray:
+        batch_size = bucket_size(len(images), self.buckets)
+        with observe_stage("normalize", record):
+            input_buffer = reuse_buffer(self._input_buffers, batch_size, self.input_dtype)
+            fill_input(input_buffer, images)
+
+        with observe_stage("invoke", record):
+            result = self.session.run([self.output_name], {self.input_name: input_buffer})[0]
+        if record:
+            BATCH_SIZE.observe(len(images))
+
+        if out is None:
+            out = np.empty(len(images), dtype=np.float32)
+        out[:] = result[:len(images), 0]
+        return out
+
+
+class OpenVinoSession:
+    def __init__(self, num_threads: int | None = None, buckets: Sequence[int] = ()):
+        import openvino as ov
+
+        core = ov.Core()
+        properties = {"PERFORMANCE_HINT": "LATENCY"}
+        if num_threads:
+            properties["INFERENCE_NUM_THREADS"] = num_threads
+        self.compiled = core.compile_model(core.read_model(str(get_model.ONNX_MODEL_PATH)), "CPU", properties)
+        self.input_dtype = np.uint8 if self.compiled.input(0).get_element_type() == ov.Type.u8 else np.float32
+        self.buckets = sorted(buckets)
+        # Свой infer request на каждый размер батча: его тензоры остаются выделенными под этот размер
+        self._requests: dict[int, object] = {}
+        self._input_buffers: dict[int, np.ndarray] = {}
+
+    def predict(self, images: Sequence[np.ndarray], out: np.ndarray | None = None, record: bool = True) -> np.ndarray:
+        batch_size = bucket_size(len(images), self.buckets)
+        with observe_stage("normalize", record):
+            input_buffer = reuse_buffer(self._input_buffers, batch_size, self.input_dtype)
+            fill_input(input_buffer, images)
+
+        request = self._requests.get(batch_size)
+        if request is None:
+            request = self._requests[batch_size] = self.compiled.create_infer_request()
+        with observe_stage("invoke", record):
+            request.infer({0: input_buffer}, share_inputs=True)
+        if record:
+            BATCH_SIZE.observe(len(images))
+
+        if out is None:
+            out = np.empty(len(images), dtype=np.float32)
+        out[:] = request.get_output_tensor(0).data[:len(images), 0]
+        return out
+
+
+def reuse_buffer(buffers: dict[int, np.ndarray], batch_size: int, dtype) -> np.ndarray:
+    # Буфер входа на каждый размер батча создаётся один раз. Размеров немного: батчи дополняются до buckets
+    buffer = buffers.get(batch_size)
+    if buffer is None:
+        buffer = buffers[batch_size] = np.zeros((batch_size, *INPUT_SHAPE), dtype=dtype)
+    return buffer
+
+
+def load_tflite(num_threads: int | None = None, buckets: Sequence[int] = ()) -> InferenceSession:
+    return InferenceSession(
+        get_model.try_load_model(num_threads=num_threads),
+        buckets,
+        partial(get_model.try_load_model, num_threads=num_threads) if buckets else None,
+    )
+
+
+# TFLite идёт первым: это эталон, с которым сверяются выходы остальных бэкендов.
+# XNNPACK в LiteRT и tflite-runtime включён по умолчанию
+BACKENDS: dict[str, Callable] = {
+    "tflite": load_tflite,
+    "onnxruntime": OnnxRuntimeSession,
+    "openvino": OpenVinoSession,
+}
+BACKEND_MODULES = {"onnxruntime": "onnxruntime", "openvino": "openvino"}
+
+
+def load_session(backend: str, num_threads: int | None = None, buckets: Sequence[int] = ()):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    return BACKENDS[backend](num_threads, buckets)
+
+
+def predict(session, images: Sequence[np.ndarray]) -> np.ndarray:
+    return session.predict(images)
+
+
+def available_backends() -> list[str]:
+    names = []
+    for name in BACKENDS:
+        if name == "tflite":
+            if get_model.MODEL_PATH.exists():
+                names.append(name)
+        elif get_model.ONNX_MODEL_PATH.exists() and importlib.util.find_spec(BACKEND_MODULES[name]) is not None:
+            names.append(name)
+    return names
+
+
+def reference_batch(batch_size: int) -> list[np.ndarray]:
+    return list(np.random.default_rng(0).integers(0, 256, (batch_size, *INPUT_SHAPE), dtype=np.uint8))
+
+
+def check_backend(
+    name: str,
+    reference_name: str,
+    num_threads: int | None = None,
+    batch_size: int = 8,
+    tolerance: float = 0.005,
+) -> bool:
+    # Только сверка выходов с эталоном на том же батче, без замера скорости
+    images = reference_batch(batch_size)
+    try:
+        reference = load_session(reference_name, num_threads).predict(images, record=False).copy()
+        result = load_session(name, num_threads).predict(images, record=False).copy()
+    except Exception as e:
+        print(f"❌ Бэкенд {name} не прошёл сверку с {reference_name}: {e}")
+        return False
+    deviation = float(np.max(np.abs(result - reference)))
+    if deviation > tolerance:
+        print(f"❌ Бэкенд {name} расходится с эталоном на {deviation:.5f}")
+        return False
+    return True
+
+
+def select_backend(
+    candidates: Sequence[str],
+    num_threads: int | None = None,
+    batch_size: int = 8,
+    repeats: int = 10,
+    tolerance: float = 0.005,
+) -> str:
+    # Один и тот же детерминированный батч прогоняется через все бэкенды: первый служит эталоном,
+    # остальные допускаются, только если их выходы отличаются не больше чем на tolerance
+    images = reference_batch(batch_size)
+    reference = None
+    timings = {}
+    for name in candidates:
+        try:
+            session = load_session(name, num_threads)
+            result = session.predict(images, record=False).copy()
+        except Exception as e:
+            print(f"❌ Бэкенд {name} не загрузился: {e}")
+            continue
+        if reference is None:
+            reference = result
+        deviation = float(np.max(np.abs(result - reference)))
+        if deviation > tolerance:
+            print(f"❌ Бэкенд {name} расходится с эталоном на {deviation:.5f}")
+            continue
+
+        durations = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            session.predict(images, record=False)
+            durations.append(time.perf_counter() - started)
+        timings[name] = float(np.median(durations))
+        print(f"✅ Бэкенд {name}: {timings[name] * 1000:.2f} мс на батч {batch_size}, расхождение {deviation:.5f}")
+        del session
+
+    if not timings:
+        raise RuntimeError(f"No inference backend could be loaded from {list(candidates)}")
+    return min(timings, key=timings.get)
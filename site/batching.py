@@ -0,0 +1,228 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Sequence
+
+import numpy as np
+
+from admission import Overloaded, QueueDelayShedder
+from deadlines import Deadline, DeadlineExceeded, deadline_passed
+from metrics import DROPPED_WORK, SHED_REQUESTS
+
+
+class BatchClass:
+    def __init__(
+        self,
+        name: str,
+        max_batch_size: int = 16,
+        max_delay_ms: float = 5.0,
+        max_queue_size: int = 0,
+        max_concurrent_batches: int = 0,
+        weight: int = 1,
+        shedder: QueueDelayShedder | None = None,
+    ):
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay_ms / 1000
+        self.max_queue_size = max(0, max_queue_size)
+        # 0 - без своего ограничения, только общее число интерпретаторов
+        self.max_concurrent_batches = max(0, max_concurrent_batches)
+        self.weight = max(1, weight)
+        self.shedder = shedder
+        self.queue: deque = deque()
+        self.in_flight = 0
+        self.credit = 0
+
+    @property
+    def is_full(self) -> bool:
+        return bool(self.max_queue_size) and len(self.queue) >= self.max_queue_size
+
+    @property
+    def can_start(self) -> bool:
+        return bool(self.queue) and (not self.max_concurrent_batches or self.in_flight < self.max_concurrent_batches)
+
+
+class MicroBatcher:
+    # Классы перечисляются от самого срочного. strict: батч всегда собирается из самого срочного
+    # непустого класса. weighted: непустые классы получают батчи по очереди пропорционально весам
+    # (smooth weighted round-robin), так что и младший класс не голодает
+    def __init__(
+        self,
+        predict_batch: Callable[[Sequence[np.ndarray]], Awaitable[Sequence[Any]]],
+        classes: Sequence[BatchClass] | None = None,
+        policy: str = "strict",
+        max_concurrent_batches: int = 1,
+        retry_after: float = 1.0,
+    ):
+        if policy not in ("strict", "weighted"):
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.predict_batch = predict_batch
+        self.classes = {batch_class.name: batch_class for batch_class in classes or [BatchClass("default")]}
+        self.default_class = next(iter(self.classes.values()))
+        self.policy = policy
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.retry_after = retry_after
+        self._arrived: asyncio.Event | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._task: asyncio.Task | None = None
+        self._batches: set[asyncio.Task] = set()
+
+    @property
+    def queue_size(self) -> int:
+        return sum(len(batch_class.queue) for batch_class in self.classes.values())
+
+    @property
+    def is_full(self) -> bool:
+        # Для защиты от перегрузки важна очередь самого срочного класса
+        return self.default_class.is_full
+
+    def start(self):
+        self._arrived = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+    async def submit(self, array: np.ndarray, priority: str | None = None, deadline: Deadline = None) -> Any:
+        batch_class = self.classes[priority] if priority is not None else self.default_class
+        if deadline_passed(deadline):
+            DROPPED_WORK.labels("deadline").inc()
+            raise DeadlineExceeded()
+        if batch_class.is_full:
+            SHED_REQUESTS.labels("queue_full").inc()
+            raise Overloaded(self.retry_after)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch_class.queue.append((array, future, loop.time(), deadline))
+        self._arrived.set()
+        return await future
+
+    async def _wait_arrival(self, timeout: float | None):
+        # Событие взводится новой картинкой в любой очереди и освобождением интерпретатора
+        self._arrived.clear()
+        try:
+            await asyncio.wait_for(self._arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _abandoned(self, item: tuple) -> bool:
+        # Ответ уже никому не нужен: клиент отключился (future отменён) или срок ответа истёк
+        _, future, _, deadline = item
+        if future.done():
+            # Отменённое после истечения срока уже посчитал тот, кто перестал ждать по сроку
+            if future.cancelled() and not deadline_passed(deadline):
+                DROPPED_WORK.labels("cancelled").inc()
+            return True
+        if deadline_passed(deadline):
+            DROPPED_WORK.labels("deadline").inc()
+            future.set_exception(DeadlineExceeded())
+            return True
+        return False
+
+    def _shed(self, batch_class: BatchClass, item: tuple, now: float) -> bool:
+        _, future, enqueued_at, _ = item
+        if self._abandoned(item):
+            return True
+        if batch_class.shedder is not None and batch_class.shedder.should_drop(now - enqueued_at, now):
+            SHED_REQUESTS.labels("queue_delay").inc()
+            future.set_exception(Overloaded(self.retry_after))
+            return True
+        return False
+
+    def _pick(self) -> BatchClass | None:
+        ready = []
+        for batch_class in self.classes.values():
+            if batch_class.can_start:
+                ready.append(batch_class)
+            else:
+                # Простаивавший класс не копит кредит, чтобы потом не забрать несколько батчей подряд
+                batch_class.credit = 0
+        if not ready:
+            return None
+        if self.policy == "strict" or len(ready) == 1:
+            return ready[0]
+        total = sum(batch_class.weight for batch_class in ready)
+        for batch_class in ready:
+            batch_class.credit += batch_class.weight
+        chosen = max(ready, key=lambda batch_class: batch_class.credit)
+        chosen.credit -= total
+        return chosen
+
+    def _urgent_waiting(self, batch_class: BatchClass) -> bool:
+        for other in self.classes.values():
+            if other is batch_class:
+                return False
+            if other.queue:
+                return True
+        return False
+
+    async def _collect(self, batch_class: BatchClass) -> list:
+        loop = asyncio.get_running_loop()
+        items = []
+        deadline = None
+        while len(items) < batch_class.max_batch_size:
+            # Сначала забираем то, что уже лежит в очереди, и только потом ждём
+            if batch_class.queue:
+                item = batch_class.queue.popleft()
+                # Решение об отбрасывании принимается при выходе из очереди, по тому, сколько запрос прождал
+                if self._shed(batch_class, item, loop.time()):
+                    continue
+                items.append(item)
+                if deadline is None:
+                    deadline = loop.time() + batch_class.max_delay
+                continue
+            # Более срочный класс не ждёт, пока этот доберёт свой батч
+            if deadline is None or self._urgent_waiting(batch_class):
+                break
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            await self._wait_arrival(timeout)
+        return items
+
+    async def _run(self):
+        while True:
+            # Пока все интерпретаторы заняты, запросы копятся в очередях и уходят следующими полными батчами
+            await self._slots.acquire()
+            try:
+                batch_class = self._pick()
+                while batch_class is None:
+                    await self._wait_arrival(None)
+                    batch_class = self._pick()
+                # Пока батч добирался, часть запросов могла истечь или отмениться: в invoke() они не идут
+                items = [item for item in await self._collect(batch_class) if not self._abandoned(item)]
+            except BaseException:
+                self._slots.release()
+                raise
+            if not items:
+                self._slots.release()
+                continue
+            batch_class.in_flight += 1
+            task = asyncio.create_task(self._process(batch_class, items))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _process(self, batch_class: BatchClass, items: list):
+        try:
+            results = await self.predict_batch([item[0] for item in items])
+        except Exception as e:
+            for _, future, _, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            batch_class.in_flight -= 1
+            self._slots.release()
+            self._arrived.set()
+        for (_, future, _, _), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,49 @@
+import io
+import uuid
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def synthetic_photo(size: tuple[int, int], mode: str = "RGB") -> Image.Image:
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    # Гладкая картинка сжимается примерно как настоящее фото, в отличие от чистого шума
+    img = Image.fromarray(noise).resize(size, Image.Resampling.BICUBIC)
+    if mode == "P":
+        return img.quantize(256)
+    return img.convert(mode)
+
+
+def mole_image(rng: np.random.Generator, size: tuple[int, int]) -> Image.Image:
+    # Пятно неровной формы на коже с шумом и размытием: по размеру файла и времени декодирования
+    # такая картинка ближе к настоящему фото, чем однотонная или чистый шум
+    width, height = size
+    skin = rng.uniform((170, 120, 100), (235, 190, 160))
+    img = Image.new("RGB", size, tuple(int(c) for c in skin))
+    draw = ImageDraw.Draw(img)
+    cx, cy = width * rng.uniform(0.35, 0.65), height * rng.uniform(0.35, 0.65)
+    radius = min(size) * rng.uniform(0.1, 0.3)
+    angles = np.linspace(0, 2 * np.pi, 24, endpoint=False)
+    radii = radius * rng.uniform(0.75, 1.25, angles.size)
+    outline = [(cx + r * np.cos(a), cy + r * np.sin(a)) for r, a in zip(radii, angles)]
+    draw.polygon(outline, fill=tuple(int(c) for c in rng.uniform((40, 20, 10), (120, 80, 60))))
+    noise = rng.normal(0, 8, (height, width, 3))
+    pixels = np.clip(np.asarray(img, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(radius=min(size) / 200))
+
+
+def encode(img: Image.Image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, image_format, quality=90)
+    return buffer.getvalue()
+
+
+def multipart(data: bytes, content_type: str, filename: str = "mole") -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
@@ -0,0 +1,61 @@
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import get_model
+from inference import INPUT_SHAPE, InferenceSession
+
+
+def predict_legacy(interpreter, batch: np.ndarray) -> np.ndarray:
+    # Старый путь predict_mole_tflite: details на каждый вызов, float-копия, set_tensor, get_tensor
+    input_details = interpreter.get_input_details()
+    output_details = interpreter.get_output_details()
+    if input_details[0]["dtype"] == np.float32:
+        batch = np.array(batch, dtype=np.float32) / 255.0
+    if tuple(input_details[0]["shape"]) != batch.shape:
+        interpreter.resize_tensor_input(input_details[0]["index"], batch.shape)
+        interpreter.allocate_tensors()
+    interpreter.set_tensor(input_details[0]["index"], batch)
+    interpreter.invoke()
+    return interpreter.get_tensor(output_details[0]["index"])[:, 0].copy()
+
+
+def measure(name: str, fn, repeats: int):
+    fn()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed / repeats * 1000:9.3f} ms/call   peak python allocations {peak / 1024:9.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение старого пути инференса и InferenceSession")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    legacy_interpreter = get_model.try_load_model()
+    session = InferenceSession(get_model.try_load_model())
+
+    for batch_size in args.batch_sizes:
+        images = [rng.integers(0, 256, INPUT_SHAPE, dtype=np.uint8) for _ in range(batch_size)]
+        stacked = np.stack(images)
+        out = np.empty(batch_size, dtype=np.float32)
+        print(f"batch={batch_size}")
+        measure("legacy", lambda: predict_legacy(legacy_interpreter, stacked), args.repeats)
+        measure("session", lambda: session.predict(images, out=out), args.repeats)
+
+
+if __name__ == "__main__":
+    main()
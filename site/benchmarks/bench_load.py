@@ -0,0 +1,248 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from _corpus import encode, mole_image, multipart
+
+
+SITE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "load_baseline.json"
+CORPUS_SIZES = ((260, 260), (640, 480), (1280, 960), (4032, 3024))
+CORPUS_FORMATS = (("JPEG", "image/jpeg"), ("PNG", "image/png"), ("WEBP", "image/webp"))
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def build_corpus(count: int, seed: int) -> list[dict]:
+    # Все тела разные, иначе кэш и объединение одинаковых запросов измерят сами себя
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for i in range(count):
+        size = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        image_format, content_type = CORPUS_FORMATS[(i // len(CORPUS_SIZES)) % len(CORPUS_FORMATS)]
+        data = encode(mole_image(rng, size), image_format)
+        body, multipart_type = multipart(data, content_type, f"mole.{image_format.lower()}")
+        corpus.append({
+            "name": f"{size[0]}x{size[1]}.{image_format.lower()}",
+            "body": body,
+            "content_type": multipart_type,
+        })
+    return corpus
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(host: str, port: int, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request("GET", "/readyz")
+            response = conn.getresponse()
+            payload = response.read()
+            conn.close()
+            if response.status == 200:
+                return json.loads(payload)
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Сервер не стал готов за {timeout} с")
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    # Кэш выключен, чтобы мерить сам путь запроса, а не попадания в кэш
+    env = dict(os.environ, MOLE_CACHE_BACKEND="none", TF_CPP_MIN_LOG_LEVEL="3")
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=SITE_DIR,
+        env=env,
+    )
+
+
+def run_level(host: str, port: int, corpus: list[dict], concurrency: int, duration: float, warmup: float) -> dict:
+    latencies = []
+    statuses: dict[str, int] = {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client(worker: int):
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        i = worker
+        local_latencies = []
+        local_statuses: dict[str, int] = {}
+        while True:
+            item = corpus[i % len(corpus)]
+            i += concurrency
+            request_started = time.perf_counter()
+            if request_started >= stop_at:
+                break
+            try:
+                conn.request("POST", "/check-mole", item["body"], {"Content-Type": item["content_type"]})
+                response = conn.getresponse()
+                response.read()
+                status = str(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=60)
+            finished = time.perf_counter()
+            if request_started < measure_from:
+                continue
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+            if status == "200":
+                local_latencies.append(finished - request_started)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(worker,)) for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Запросы, начатые до конца окна, дорабатывают после него: делим на фактическое время
+    elapsed = max(time.perf_counter() - measure_from, 1e-9)
+
+    result = {
+        "concurrency": concurrency,
+        "requests": sum(statuses.values()),
+        "ok": len(latencies),
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+    if latencies:
+        latencies_ms = np.asarray(latencies) * 1000
+        for metric, q in zip(LATENCY_METRICS, (50, 95, 99)):
+            result[metric] = round(float(np.percentile(latencies_ms, q)), 2)
+    return result
+
+
+def git_commit() -> str | None:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SITE_DIR, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    # Регрессия - рост любой задержки или падение пропускной способности больше чем на threshold процентов
+    regressions = []
+    baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in results["levels"]:
+        old = baseline_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if metric in level and metric in old and level[metric] > old[metric] * (1 + threshold / 100):
+                regressions.append(
+                    f"c={level['concurrency']} {metric}: {old[metric]} -> {level[metric]} "
+                    f"(+{(level[metric] / old[metric] - 1) * 100:.0f}%)"
+                )
+        if old["throughput_rps"] and level["throughput_rps"] < old["throughput_rps"] * (1 - threshold / 100):
+            regressions.append(
+                f"c={level['concurrency']} throughput_rps: {old['throughput_rps']} -> {level['throughput_rps']} "
+                f"({(level['throughput_rps'] / old['throughput_rps'] - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /check-mole со ступенчатой конкурентностью и сравнением с базой")
+    parser.add_argument("--url", help="Уже запущенный сервер, например http://127.0.0.1:8000 (по умолчанию поднимается свой)")
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=10, help="Секунд замера на каждую ступень")
+    parser.add_argument("--warmup", type=float, default=2, help="Секунд прогрева перед каждой ступенью")
+    parser.add_argument("--corpus-size", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_results.json")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--update-baseline", action="store_true", help="Сохранить результат как новую базу")
+    parser.add_argument("--threshold", type=float, default=10, help="Допустимое ухудшение, %%")
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_size, args.seed)
+    print(f"Корпус: {len(corpus)} запросов, {sum(len(item['body']) for item in corpus) / 2**20:.1f} МБ")
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = "127.0.0.1", free_port()
+        server = start_server(port, args.server_workers)
+    try:
+        ready = wait_ready(host, port, args.ready_timeout)
+        levels = []
+        for concurrency in args.concurrency:
+            level = run_level(host, port, corpus, concurrency, args.duration, args.warmup)
+            levels.append(level)
+            latency = "   ".join(f"{metric[:3]} {level[metric]:8.1f} ms" for metric in LATENCY_METRICS if metric in level)
+            print(f"c={concurrency:<4} {level['throughput_rps']:8.1f} req/s   {latency}   {level['statuses']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "model_version": ready.get("model_version"),
+        "backend": ready.get("backend"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "settings": {
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "corpus_size": len(corpus),
+            "server_workers": None if args.url else args.server_workers,
+        },
+        "levels": levels,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты сохранены в {args.output}")
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ База обновлена: {baseline_path}")
+        return
+    if not baseline_path.exists():
+        print(f"Базы {baseline_path} нет, сравнивать не с чем (--update-baseline сохранит текущий результат)")
+        return
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"❌ Ухудшение больше {args.threshold}% относительно {baseline.get('commit')}:")
+        for line in regressions:
+            print(f"   {line}")
+        sys.exit(1)
+    print(f"✅ Без ухудшений больше {args.threshold}% относительно {baseline.get('commit')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import io
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from starlette.datastructures import Headers
+from starlette.formparsers import MultiPartParser
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import get_model
+from inference import INPUT_SCALE, INPUT_SHAPE, INPUT_SIZE, InferenceSession, center_square, fill_input, load_image
+from uploads import UPLOAD_CHUNK_SIZE, read_upload
+
+from _corpus import encode, multipart, synthetic_photo
+
+
+IMAGE_KINDS = {
+    "jpeg": ("JPEG", "RGB", "image/jpeg"),
+    "png": ("PNG", "RGB", "image/png"),
+    "png-rgba": ("PNG", "RGBA", "image/png"),
+    "png-palette": ("PNG", "P", "image/png"),
+}
+
+
+def measure(setup, fn, repeats: int) -> dict:
+    # setup готовит свежий вход и в замер не попадает: open() и load() меняют картинку на месте,
+    # поэтому каждый повтор стадии начинается с нового объекта
+    fn(setup())
+    times = []
+    for _ in range(repeats):
+        arg = setup()
+        started = time.perf_counter_ns()
+        fn(arg)
+        times.append(time.perf_counter_ns() - started)
+    # Аллокации - отдельным прогоном: tracemalloc сам по себе замедляет код.
+    # Он видит numpy и Python-объекты, но не пиксельные буферы PIL, их показывает out_kib
+    arg = setup()
+    tracemalloc.start()
+    result = fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_us": round(statistics.median(times) / 1000, 1),
+        "p90_us": round(float(np.percentile(times, 90)) / 1000, 1),
+        "alloc_peak_kib": round(peak / 1024, 1),
+        "out_kib": round(result_bytes(result) / 1024, 1),
+    }
+
+
+def result_bytes(result) -> int:
+    if isinstance(result, Image.Image):
+        return result.width * result.height * len(result.getbands())
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, bytes):
+        return len(result)
+    return 0
+
+
+def parse_multipart(loop: asyncio.AbstractEventLoop, body: bytes, content_type: str) -> bytes:
+    # То же, что делает FastAPI для UploadFile плюс read_upload из check_mole
+    async def stream():
+        for start in range(0, len(body), UPLOAD_CHUNK_SIZE):
+            yield body[start:start + UPLOAD_CHUNK_SIZE]
+
+    async def parse():
+        headers = Headers({"content-type": content_type, "content-length": str(len(body))})
+        form = await MultiPartParser(headers, stream()).parse()
+        upload = form["file"]
+        try:
+            return await read_upload(upload, len(body))
+        finally:
+            await form.close()
+
+    return loop.run_until_complete(parse())
+
+
+def opened(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+def decode(img: Image.Image) -> Image.Image:
+    if img.format in ("JPEG", "MPO"):
+        img.draft(img.mode, INPUT_SIZE)
+    img.load()
+    img.getexif()
+    return img
+
+
+def decoded(data: bytes) -> Image.Image:
+    return decode(opened(data))
+
+
+def convert(img: Image.Image) -> Image.Image:
+    # Палитра переводится в RGB до ресайза, прочие режимы - после, уже на 260x260
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
+
+
+def resize(img: Image.Image) -> Image.Image:
+    return img.resize(INPUT_SIZE, box=center_square(img.size), reducing_gap=3.0)
+
+
+def image_stages(loop, kind: str, size: tuple[int, int], repeats: int) -> dict:
+    image_format, mode, content_type = IMAGE_KINDS[kind]
+    data = encode(synthetic_photo(size, mode), image_format)
+    body, multipart_type = multipart(data, content_type)
+    palette = mode in ("P", "PA")
+
+    def before_resize():
+        img = decoded(data)
+        return convert(img) if palette else img
+
+    def before_convert():
+        img = decoded(data)
+        return img if palette else resize(img)
+
+    stages = {
+        "multipart": measure(lambda: None, lambda _: parse_multipart(loop, body, multipart_type), repeats),
+        "open": measure(lambda: data, opened, repeats),
+        "decode": measure(lambda: opened(data), decode, repeats),
+        "convert": measure(before_convert, convert, repeats),
+        "resize": measure(before_resize, resize, repeats),
+        "to_array": measure(lambda: convert(resize(before_resize())), lambda img: np.asarray(img, dtype=np.uint8), repeats),
+        "load_image": measure(lambda: data, load_image, repeats),
+    }
+    return {"kind": kind, "size": f"{size[0]}x{size[1]}", "file_kib": round(len(data) / 1024, 1), "stages": stages}
+
+
+def batch_stages(session: InferenceSession, batch_size: int, repeats: int) -> dict:
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, INPUT_SHAPE, dtype=np.uint8) for _ in range(batch_size)]
+    interpreter = session.interpreter
+    session._ensure_shape((batch_size, *INPUT_SHAPE))
+
+    def stack(_):
+        # Старый путь: np.stack и отдельная float-копия перед set_tensor
+        batch = np.stack(images)
+        if session.input_dtype == np.float32:
+            batch = batch.astype(np.float32) * INPUT_SCALE
+        return batch
+
+    def fill(_):
+        buffer = interpreter.tensor(session.input_index)()
+        fill_input(buffer, images)
+        del buffer
+
+    def extract(_):
+        out = np.empty(batch_size, dtype=np.float32)
+        buffer = interpreter.tensor(session.output_index)()
+        out[:] = buffer[:, 0]
+        del buffer
+        return out
+
+    stacked = stack(None)
+    stages = {
+        "stack": measure(lambda: None, stack, repeats),
+        "set_tensor": measure(lambda: stacked, lambda batch: interpreter.set_tensor(session.input_index, batch), repeats),
+        "normalize": measure(lambda: None, fill, repeats),
+        "invoke": measure(lambda: None, lambda _: interpreter.invoke(), repeats),
+        "extract": measure(lambda: None, extract, repeats),
+        "predict": measure(lambda: None, lambda _: session.predict(images), repeats),
+    }
+    return {"batch_size": batch_size, "stages": stages}
+
+
+def print_table(title: str, stages: dict):
+    print(title)
+    for stage, row in stages.items():
+        print(
+            f"  {stage:<11} {row['median_us']:10.1f} us   p90 {row['p90_us']:10.1f} us   "
+            f"alloc {row['alloc_peak_kib']:9.1f} KiB   out {row['out_kib']:9.1f} KiB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время и аллокации по стадиям пути check_mole -> инференс")
+    parser.add_argument("--sizes", nargs="+", default=["260x260", "1024x768", "2048x1536", "4032x3024"])
+    parser.add_argument("--kinds", nargs="+", choices=list(IMAGE_KINDS), default=["jpeg", "png", "png-palette"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = {"images": [], "batches": []}
+    loop = asyncio.new_event_loop()
+    try:
+        for kind in args.kinds:
+            for size in args.sizes:
+                width, height = (int(side) for side in size.split("x"))
+                row = image_stages(loop, kind, (width, height), args.repeats)
+                results["images"].append(row)
+                print_table(f"{row['kind']} {row['size']} ({row['file_kib']} KiB)", row["stages"])
+    finally:
+        loop.close()
+
+    session = InferenceSession(get_model.try_load_model())
+    for batch_size in args.batch_sizes:
+        row = batch_stages(session, batch_size, args.repeats)
+        results["batches"].append(row)
+        print_table(f"batch={batch_size}", row["stages"])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+SITE_DIR = Path(__file__).resolve().parent.parent
+
+# Замер в отдельном процессе: иначе уже импортированные модули исказят и время, и память
+PROBE = """
+import json, resource, time
+started = time.perf_counter()
+import get_model
+interpreter = get_model.try_load_model()
+loaded = time.perf_counter() - started
+print(json.dumps({
+    "runtime": get_model.interpreter_class().__module__,
+    "startup_s": round(loaded, 3),
+    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+}))
+"""
+
+
+def probe(runtime: str) -> dict | None:
+    env = dict(os.environ, MOLE_TFLITE_RUNTIME=runtime, TF_CPP_MIN_LOG_LEVEL="3")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=SITE_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время старта и RSS при загрузке модели разными TFLite рантаймами")
+    parser.add_argument("--runtimes", nargs="+", default=["litert", "tflite_runtime", "tensorflow"])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for runtime in args.runtimes:
+        runs = [probe(runtime) for _ in range(args.repeats)]
+        if None in runs:
+            print(f"{runtime:<15} не установлен")
+            continue
+        startup = min(run["startup_s"] for run in runs)
+        rss = min(run["max_rss_mb"] for run in runs)
+        print(f"{runtime:<15} старт {startup:7.3f} с   RSS {rss:8.1f} МБ   ({runs[0]['runtime']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Кэш выключаем, иначе одинаковые тела запросов будут мерить только кэш
+os.environ["MOLE_CACHE_BACKEND"] = "none"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+from inference import INPUT_SIZE
+
+from _corpus import encode, multipart, synthetic_photo
+
+
+async def call(path: str, body: bytes, content_type: str) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+    # Как настоящий сервер: после тела receive() ждёт, пока ответ не уйдёт целиком. Сразу отданный
+    # http.disconnect приложение приняло бы за обрыв соединения и ответило бы 499
+    responded = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await responded.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            responded.set()
+
+    await main.app(scope, receive, send)
+    return status
+
+
+async def measure(name: str, path: str, body: bytes, content_type: str, repeats: int):
+    assert await call(path, body, content_type) == 200, name
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(repeats):
+        await call(path, body, content_type)
+    cpu = (time.process_time() - cpu) / repeats * 1000
+    wall = (time.perf_counter() - wall) / repeats * 1000
+    print(f"{name:<28} {len(body) / 1024:9.1f} KiB   cpu {cpu:8.3f} ms/req   wall {wall:8.3f} ms/req")
+
+
+async def run(repeats: int, photo_size: tuple[int, int]):
+    photo = synthetic_photo(photo_size)
+    small = photo.resize(INPUT_SIZE, box=(0, 0, min(photo_size), min(photo_size)))
+    jpeg = encode(photo, "JPEG")
+    small_webp = encode(small, "WEBP")
+    raw_rgb = np.asarray(small, dtype=np.uint8).tobytes()
+
+    async with main.app.router.lifespan_context(main.app):
+        # Модель грузится в фоне после старта, до её готовности /check-mole отвечает 503
+        await main.model_loading
+        body, content_type = multipart(jpeg, "image/jpeg", "mole.jpg")
+        await measure("multipart /check-mole", "/check-mole", body, content_type, repeats)
+        await measure("octet-stream jpeg", "/check-mole/raw", jpeg, "application/octet-stream", repeats)
+        body, content_type = multipart(small_webp, "image/webp", "mole.webp")
+        await measure("multipart 260 webp", "/check-mole", body, content_type, repeats)
+        await measure("octet-stream 260 webp", "/check-mole/raw", small_webp, "application/octet-stream", repeats)
+        await measure("raw rgb 260x260", "/check-mole/raw", raw_rgb, main.RAW_RGB_CONTENT_TYPE, repeats)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="CPU на запрос для multipart, octet-stream и готового RGB")
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--photo-size", type=int, nargs=2, default=[4032, 3024])
+    args = parser.parse_args()
+    asyncio.run(run(args.repeats, tuple(args.photo_size)))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,119 @@
+import os
+
+
+# TFLite рантайм: auto (LiteRT, затем tflite-runtime, затем полный tensorflow), litert, tflite_runtime или tensorflow
+TFLITE_RUNTIME = os.getenv("MOLE_TFLITE_RUNTIME", "auto")
+
+# Бэкенд инференса: auto (замерить установленные при первой загрузке модели и выбрать самый быстрый),
+# tflite, onnxruntime или openvino. Выходы кандидатов сверяются с TFLite с допуском BACKEND_TOLERANCE
+INFERENCE_BACKEND = os.getenv("MOLE_INFERENCE_BACKEND", "auto")
+BACKEND_TOLERANCE = float(os.getenv("MOLE_BACKEND_TOLERANCE", "0.005"))
+BACKEND_BENCH_REPEATS = int(os.getenv("MOLE_BACKEND_BENCH_REPEATS", "10"))
+
+# Микро-батчинг запросов к модели
+BATCH_MAX_SIZE = int(os.getenv("MOLE_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_DELAY_MS = float(os.getenv("MOLE_BATCH_MAX_DELAY_MS", "5"))
+
+# Защита от перегрузки: очередь батчера ограничена, а запросы, которые в стоячей очереди ждут
+# дольше SHED_TARGET_MS (CoDel с интервалом SHED_INTERVAL_MS), сразу получают 503 с Retry-After
+MAX_QUEUE_SIZE = int(os.getenv("MOLE_MAX_QUEUE_SIZE", str(BATCH_MAX_SIZE * 16)))
+SHED_TARGET_MS = float(os.getenv("MOLE_SHED_TARGET_MS", "100"))
+SHED_INTERVAL_MS = float(os.getenv("MOLE_SHED_INTERVAL_MS", "500"))
+SHED_RETRY_AFTER_S = float(os.getenv("MOLE_SHED_RETRY_AFTER_S", "1"))
+# Ограничение частоты запросов на клиента (token bucket): запросов в секунду (0 - выключено) и размер всплеска.
+# Клиент определяется по заголовку CLIENT_ID_HEADER, если он задан, иначе по IP
+CLIENT_RATE = float(os.getenv("MOLE_CLIENT_RATE", "0"))
+CLIENT_BURST = float(os.getenv("MOLE_CLIENT_BURST", "10"))
+CLIENT_ID_HEADER = os.getenv("MOLE_CLIENT_ID_HEADER", "")
+
+# Срок ответа на /check-mole: серверный по умолчанию (0 - без срока) и заголовок, в котором клиент
+# передаёт свой таймаут в миллисекундах (берётся меньший). Картинки с истёкшим сроком и от отключившихся
+# клиентов выбрасываются из очереди до invoke()
+REQUEST_TIMEOUT_MS = float(os.getenv("MOLE_REQUEST_TIMEOUT_MS", "15000"))
+REQUEST_TIMEOUT_HEADER = os.getenv("MOLE_REQUEST_TIMEOUT_HEADER", "X-Request-Timeout-Ms")
+
+# /readyz отвечает 503, если p95 последних инференсов выше порога (0 - не проверять)
+READY_MAX_P95_MS = float(os.getenv("MOLE_READY_MAX_P95_MS", "0"))
+
+# Test-time augmentation для пограничных ответов: если уверенность ближе TTA_BAND к одному из порогов,
+# картинка перепроверяется на 8 отражениях и поворотах одним батчем и результат усредняется
+TTA_ENABLED = os.getenv("MOLE_TTA", "0") == "1"
+TTA_BAND = float(os.getenv("MOLE_TTA_BAND", "0.03"))
+
+# Пул интерпретаторов: каждый работает в своём потоке со своим числом потоков TFLite
+INTERPRETER_POOL_SIZE = int(os.getenv("MOLE_INTERPRETER_POOL_SIZE", "2"))
+INTERPRETER_NUM_THREADS = int(
+    os.getenv("MOLE_INTERPRETER_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // INTERPRETER_POOL_SIZE)))
+)
+
+# Отдельные процессы инференса с передачей картинок через shared memory (0 - инференс в этом процессе)
+INFERENCE_PROCESSES = int(os.getenv("MOLE_INFERENCE_PROCESSES", "0"))
+
+# Приоритеты в батчере: interactive - /check-mole и /check-mole/raw, bulk - /check-mole/batch и задания /jobs.
+# strict: bulk получает интерпретатор, только когда интерактивная очередь пуста; weighted: батчи делятся
+# по весам INTERACTIVE_WEIGHT:BULK_WEIGHT. В обоих режимах bulk занимает не больше BULK_MAX_CONCURRENT_BATCHES
+# интерпретаторов (по умолчанию на один меньше, чем есть), поэтому одиночный запрос не ждёт за чужим большим батчем
+SCHEDULING_POLICY = os.getenv("MOLE_SCHEDULING_POLICY", "strict")
+INTERACTIVE_WEIGHT = int(os.getenv("MOLE_INTERACTIVE_WEIGHT", "4"))
+BULK_WEIGHT = int(os.getenv("MOLE_BULK_WEIGHT", "1"))
+BULK_BATCH_MAX_SIZE = int(os.getenv("MOLE_BULK_BATCH_MAX_SIZE", str(BATCH_MAX_SIZE)))
+BULK_BATCH_MAX_DELAY_MS = float(os.getenv("MOLE_BULK_BATCH_MAX_DELAY_MS", "20"))
+BULK_MAX_QUEUE_SIZE = int(os.getenv("MOLE_BULK_MAX_QUEUE_SIZE", str(MAX_QUEUE_SIZE)))
+BULK_MAX_CONCURRENT_BATCHES = int(
+    os.getenv("MOLE_BULK_MAX_CONCURRENT_BATCHES", str(max(1, (INFERENCE_PROCESSES or INTERPRETER_POOL_SIZE) - 1)))
+)
+# Цель по ожиданию в очереди для bulk (0 - не отбрасывать по задержке, только по длине очереди)
+BULK_SHED_TARGET_MS = float(os.getenv("MOLE_BULK_SHED_TARGET_MS", "0"))
+
+# Каждый батч дополняется до ближайшего сверху размера из BATCH_BUCKETS (по умолчанию степени двойки
+# и самый крупный батч из классов батчера). Под каждый размер тензоры выделены заранее, и смена размера
+# между батчами не перевыделяет их и не перестраивает ядра XNNPACK. TFLite держит на каждый размер
+# свой интерпретатор, поэтому длинный список стоит памяти. Все размеры прогреваются при старте,
+# до того как /readyz ответит 200
+MAX_BATCH_SIZE = max(BATCH_MAX_SIZE, BULK_BATCH_MAX_SIZE)
+BATCH_BUCKETS = sorted(
+    {
+        int(size)
+        for size in os.getenv(
+            "MOLE_BATCH_BUCKETS", ",".join(str(1 << i) for i in range(MAX_BATCH_SIZE.bit_length()))
+        ).split(",")
+        if size.strip()
+    }
+    | {MAX_BATCH_SIZE}
+)
+
+# Кэш предсказаний по хэшу загруженного файла: memory, redis или none
+CACHE_BACKEND = os.getenv("MOLE_CACHE_BACKEND", "memory")
+CACHE_MAX_ITEMS = int(os.getenv("MOLE_CACHE_MAX_ITEMS", "4096"))
+CACHE_TTL_S = float(os.getenv("MOLE_CACHE_TTL_S", "3600"))
+CACHE_REDIS_URL = os.getenv("MOLE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Пакетная загрузка /check-mole/batch: сколько картинок одновременно читается и ждёт модель
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("MOLE_BATCH_UPLOAD_CONCURRENCY", "64"))
+
+# Асинхронные задания /jobs: очередь в SQLite переживает перезапуск. Задания забираются полными батчами
+# (не больше JOBS_MAX_CONCURRENT_BATCHES сразу) и идут в модель с приоритетом bulk
+JOBS_DB_PATH = os.getenv("MOLE_JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+JOBS_BATCH_SIZE = int(os.getenv("MOLE_JOBS_BATCH_SIZE", str(BATCH_MAX_SIZE)))
+JOBS_MAX_CONCURRENT_BATCHES = int(os.getenv("MOLE_JOBS_MAX_CONCURRENT_BATCHES", "1"))
+JOBS_MAX_PENDING = int(os.getenv("MOLE_JOBS_MAX_PENDING", "1000"))
+JOBS_POLL_INTERVAL_S = float(os.getenv("MOLE_JOBS_POLL_INTERVAL_S", "1"))
+# Через сколько секунд задание упавшего процесса снова выдаётся в работу и сколько раз пробовать
+JOBS_LEASE_S = float(os.getenv("MOLE_JOBS_LEASE_S", "60"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("MOLE_JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RESULT_TTL_S = float(os.getenv("MOLE_JOBS_RESULT_TTL_S", str(7 * 24 * 3600)))
+JOBS_CALLBACK_TIMEOUT_S = float(os.getenv("MOLE_JOBS_CALLBACK_TIMEOUT_S", "10"))
+JOBS_CALLBACK_RETRIES = int(os.getenv("MOLE_JOBS_CALLBACK_RETRIES", "5"))
+# Колбэки уходят с сервера, поэтому адреса внутренней сети (loopback, частные, link-local) запрещены.
+# Список хостов через запятую ограничивает колбэки только ими
+JOBS_CALLBACK_ALLOWED_HOSTS = tuple(
+    host.strip().lower() for host in os.getenv("MOLE_JOBS_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+JOBS_CALLBACK_ALLOW_PRIVATE = os.getenv("MOLE_JOBS_CALLBACK_ALLOW_PRIVATE", "0") == "1"
+
+# Максимальный размер одной загружаемой картинки (обещан в FAQ)
+MAX_UPLOAD_BYTES = int(os.getenv("MOLE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Горячая замена модели: период проверки model/model.tflite (0 - не следить) и токен для /admin/reload-model
+MODEL_WATCH_INTERVAL_S = float(os.getenv("MOLE_MODEL_WATCH_INTERVAL_S", "10"))
+ADMIN_TOKEN = os.getenv("MOLE_ADMIN_TOKEN", "")
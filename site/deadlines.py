@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Awaitable, TypeVar
+
+from fastapi import Request
+
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__("Deadline exceeded")
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class SharedDeadline:
+    # Срок работы, которую ждут несколько одинаковых запросов: самый поздний из их сроков.
+    # Запрос без срока снимает ограничение совсем
+    def __init__(self, at: float | None):
+        self.at = at
+
+    def extend(self, at: float | None):
+        if self.at is not None:
+            self.at = None if at is None else max(self.at, at)
+
+
+Deadline = float | SharedDeadline | None
+
+
+def deadline_passed(deadline: Deadline) -> bool:
+    if isinstance(deadline, SharedDeadline):
+        deadline = deadline.at
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class DeadlineMiddleware:
+    # Срок ответа отсчитывается от прихода запроса, до чтения тела: медленная загрузка тоже его тратит.
+    # Клиент передаёт свой таймаут в миллисекундах в заголовке и может только сократить серверный
+    def __init__(self, app, paths: set[str], default_ms: float, header: str):
+        self.app = app
+        self.paths = paths
+        self.default_ms = default_ms
+        self.header = header.lower().encode()
+
+    def timeout_ms(self, scope) -> float | None:
+        timeout = self.default_ms or None
+        for name, value in scope["headers"]:
+            if name == self.header:
+                try:
+                    client_timeout = float(value)
+                except ValueError:
+                    break
+                if client_timeout > 0:
+                    timeout = min(timeout, client_timeout) if timeout else client_timeout
+                break
+        return timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            timeout = self.timeout_ms(scope)
+            if timeout is not None:
+                scope.setdefault("state", {})["deadline"] = time.monotonic() + timeout / 1000
+        await self.app(scope, receive, send)
+
+
+def request_deadline(request: Request) -> float | None:
+    return getattr(request.state, "deadline", None)
+
+
+async def _wait_disconnect(request: Request):
+    # Тело уже прочитано, поэтому следующее сообщение от сервера придёт только при обрыве соединения
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def until_disconnected(request: Request, work: Awaitable[T]) -> T:
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.create_task(_wait_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if not task.done():
+        # Отмена дойдёт по цепочке до future в очереди батчера, и картинка не попадёт в invoke()
+        task.cancel()
+        raise ClientDisconnected()
+    return task.result()
@@ -1,13 +1,51 @@
+import hashlib
+import importlib
 from pathlib import Path
-import tensorflow as tf
 
+import config
 
-MODEL_PATH = Path(__file__).parent / "model" / "model.tflite"
 
+MODEL_DIR = Path(__file__).parent / "model"
+MODEL_PATH = MODEL_DIR / "model.tflite"
+# Та же модель, экспортированная в ONNX, для ONNX Runtime и OpenVINO
+ONNX_MODEL_PATH = MODEL_DIR / "model.onnx"
+MODEL_FILES = (MODEL_PATH, ONNX_MODEL_PATH)
+INTERPRETER_MODULES = {
+    "litert": "ai_edge_litert.interpreter",
+    "tflite_runtime": "tflite_runtime.interpreter",
+}
+_interpreter_class = None
 
-def try_load_model():
+
+def interpreter_class():
+    # Полный tensorflow импортируется секунды и занимает сотни МБ, поэтому сначала
+    # пробуем лёгкие рантаймы LiteRT и tflite-runtime
+    global _interpreter_class
+    if _interpreter_class is not None:
+        return _interpreter_class
+
+    runtimes = list(INTERPRETER_MODULES) + ["tensorflow"]
+    if config.TFLITE_RUNTIME != "auto":
+        runtimes = [config.TFLITE_RUNTIME]
+    for runtime in runtimes:
+        try:
+            if runtime == "tensorflow":
+                import tensorflow as tf
+
+                _interpreter_class = tf.lite.Interpreter
+            else:
+                _interpreter_class = importlib.import_module(INTERPRETER_MODULES[runtime]).Interpreter
+            print(f"✅ TFLite рантайм: {runtime}")
+            return _interpreter_class
+        except ImportError:
+            continue
+    raise ImportError(f"Не найден ни один TFLite рантайм из {runtimes}")
+
+
+def try_load_model(num_threads: int | None = None):
+    Interpreter = interpreter_class()
     try:
-        interpreter = tf.lite.Interpreter(model_path=str(MODEL_PATH))
+        interpreter = Interpreter(model_path=str(MODEL_PATH), num_threads=num_threads)
         interpreter.allocate_tensors()
         return interpreter
     except Exception as e:
@@ -16,7 +54,7 @@ def try_load_model():
     try:
         with open(MODEL_PATH, "rb") as f:
             model_content = f.read()
-        interpreter = tf.lite.Interpreter(model_content=model_content)
+        interpreter = Interpreter(model_content=model_content, num_threads=num_threads)
         interpreter.allocate_tensors()
         return interpreter
     except Exception as e:
@@ -24,4 +62,12 @@ def try_load_model():
         raise
 
 
-interpreter = try_load_model()
+def model_version() -> str:
+    digest = hashlib.sha256()
+    for path in MODEL_FILES:
+        if not path.exists():
+            continue
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
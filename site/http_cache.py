@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from mako.lookup import TemplateLookup
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 512
+# Крупные файлы (например, apk приложения) в память не грузятся и отдаются StaticFiles как есть
+MAX_ASSET_BYTES = 1024 * 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # Прокси со своим сжатием ослабляют ETag до W/"...", поэтому сравниваем без префикса
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class CachedBody:
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.version = hashlib.blake2b(body, digest_size=8).hexdigest()
+        # Сжатые варианты готовятся один раз. У каждой кодировки свой сильный ETag:
+        # это разные представления одного ресурса
+        self.variants = {"identity": (body, f'"{self.version}"')}
+        if len(body) >= MIN_COMPRESS_BYTES and media_type.startswith(COMPRESSIBLE_TYPES):
+            self.variants["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{self.version}-gz"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body, quality=11), f'"{self.version}-br"')
+
+    def response(self, headers: Headers, cache_control: str) -> Response:
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""), self.variants)
+        body, etag = self.variants[encoding]
+        response_headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=response_headers)
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.media_type, headers=response_headers)
+
+
+class StaticAssets:
+    def __init__(self, directory: Path, mount_path: str = "/static"):
+        self.directory = Path(directory)
+        self.mount_path = mount_path
+        self.fallback = StaticFiles(directory=directory)
+        self.assets: dict[str, CachedBody] = {}
+        for path in sorted(self.directory.rglob("*")):
+            if path.is_file() and path.stat().st_size <= MAX_ASSET_BYTES:
+                media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+                self.assets[path.relative_to(self.directory).as_posix()] = CachedBody(path.read_bytes(), media_type)
+
+    def url(self, path: str) -> str:
+        # Версия в адресе меняется вместе с содержимым файла, поэтому такой адрес можно кэшировать навсегда
+        asset = self.assets.get(path)
+        if asset is None:
+            return f"{self.mount_path}/{path}"
+        return f"{self.mount_path}/{path}?v={asset.version}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            asset = self.assets.get(Path(self.fallback.get_path(scope)).as_posix())
+            if asset is not None:
+                versions = parse_qs(scope["query_string"].decode("latin-1")).get("v", [])
+                cache_control = IMMUTABLE if asset.version in versions else REVALIDATE
+                response = asset.response(Headers(scope=scope), cache_control)
+                await response(scope, receive, send)
+                return
+        await self.fallback(scope, receive, send)
+
+
+class PageCache:
+    def __init__(self, templates_dir: Path, context: dict, check_interval: float = 1.0):
+        self.templates_dir = templates_dir
+        self.context = context
+        self.check_interval = check_interval
+        self._lookup: TemplateLookup | None = None
+        self._pages: dict[str, CachedBody] = {}
+        self._state: tuple | None = None
+        self._checked_at = -check_interval
+
+    def _templates_state(self) -> tuple:
+        return tuple(sorted(
+            (entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(self.templates_dir) if entry.is_file()
+        ))
+
+    def get(self, name: str) -> CachedBody:
+        # Шаблоны проверяются не чаще раза в check_interval. Любая правка любого файла
+        # (в том числе общего base.mako) сбрасывает все готовые страницы вместе с TemplateLookup:
+        # его собственная проверка сравнивает время с точностью до секунды и пропускает быстрые правки
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            state = self._templates_state()
+            if state != self._state:
+                self._state = state
+                self._lookup = TemplateLookup(directories=[self.templates_dir], filesystem_checks=False)
+                self._pages.clear()
+        page = self._pages.get(name)
+        if page is None:
+            html = self._lookup.get_template(name).render(**self.context)
+            page = self._pages[name] = CachedBody(html.encode(), "text/html; charset=utf-8")
+        return page
@@ -0,0 +1,225 @@
+import io
+from typing import Any, Callable, Sequence
+
+import numpy as np
+from PIL import Image
+
+from metrics import BATCH_SIZE, observe_stage
+
+
+INPUT_SIZE = (260, 260)
+INPUT_SHAPE = (*INPUT_SIZE, 3)
+INPUT_SCALE = np.float32(1 / 255)
+
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "GIF", "BMP", "WEBP"}
+MAX_IMAGE_PIXELS = 100_000_000
+# Защита PIL от decompression bomb срабатывает и там, где размер не проверяется явно
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+EXIF_ORIENTATION = 0x0112
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def center_square(size: tuple[int, int]) -> tuple[int, int, int, int]:
+    width, height = size
+    side = min(width, height)
+    left = (width - side) // 2
+    top = (height - side) // 2
+    return left, top, left + side, top + side
+
+
+def preprocess_image(image: Image.Image) -> np.ndarray:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    img = image.resize(INPUT_SIZE, box=center_square(image.size))
+    return np.asarray(img, dtype=np.uint8)
+
+
+def tta_views(image: np.ndarray) -> list[np.ndarray]:
+    # Отражения и повороты на 90° (при обучении были флипы и Rotate): вместе с исходной
+    # картинкой это все 8 вариантов квадрата. Возвращаются представления, без копий
+    transposed = image.transpose(1, 0, 2)
+    return [
+        image,
+        image[:, ::-1],
+        image[::-1],
+        image[::-1, ::-1],
+        transposed,
+        transposed[:, ::-1],
+        transposed[::-1],
+        transposed[::-1, ::-1],
+    ]
+
+
+def decode_image(img_data: bytes) -> Image.Image:
+    try:
+        img = Image.open(io.BytesIO(img_data))
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e)) from e
+    except (OSError, SyntaxError, ValueError) as e:
+        # Файл, обрезанный посреди заголовка, падает уже здесь, а не при чтении пикселей
+        raise InvalidImage(f"Image file is corrupt: {e}") from e
+
+    # Размеры известны из заголовка, отказываем до декодирования пикселей
+    if img.format not in ALLOWED_FORMATS:
+        raise InvalidImage("Unsupported image format")
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidImage("Image resolution is too large")
+    if width < INPUT_SIZE[0] or height < INPUT_SIZE[1]:
+        raise InvalidImage(f"Image must be at least {INPUT_SIZE[0]}x{INPUT_SIZE[1]} pixels")
+
+    try:
+        return _decode_pixels(img)
+    except (OSError, SyntaxError, ValueError) as e:
+        # Обрезанный или битый файл проходит проверку заголовка и падает только при чтении пикселей
+        raise InvalidImage(f"Image file is corrupt: {e}") from e
+
+
+def _decode_pixels(img: Image.Image) -> Image.Image:
+    with observe_stage("decode"):
+        # JPEG декодируется сразу в 1/2, 1/4 или 1/8 размера, но не меньше входа модели
+        if img.format in ("JPEG", "MPO"):
+            img.draft(img.mode, INPUT_SIZE)
+        img.load()
+        # Только после load(): у PNG EXIF может лежать за пикселями, и getexif() сам декодировал бы
+        # картинку до draft() и вне стадии decode
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+
+        if img.mode in ("P", "PA"):
+            # Палитру нельзя интерполировать, переводим в RGB до ресайза
+            img = img.convert("RGB")
+
+        sixteen_bit = img.mode.startswith("I;16")
+        if sixteen_bit:
+            img = img.convert("I")
+
+    with observe_stage("resize"):
+        # Центральный квадрат, как при обучении. reducing_gap сначала ужимает картинку
+        # целочисленным reduce(), а точный ресайз делает уже на малом размере
+        img = img.resize(INPUT_SIZE, box=center_square(img.size), reducing_gap=3.0)
+
+        if sixteen_bit:
+            img = Image.fromarray((np.asarray(img) >> 8).clip(0, 255).astype(np.uint8))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if orientation in EXIF_TRANSPOSE:
+            img = img.transpose(EXIF_TRANSPOSE[orientation])
+    return img
+
+
+def load_image(img_data: bytes) -> np.ndarray:
+    return np.asarray(decode_image(img_data), dtype=np.uint8)
+
+
+def load_raw_rgb(img_data: bytes) -> np.ndarray:
+    # Клиент уже сделал кроп и ресайз: байты сразу становятся входом модели
+    if len(img_data) != int(np.prod(INPUT_SHAPE)):
+        raise InvalidImage(f"Raw RGB payload must be exactly {INPUT_SIZE[0]}x{INPUT_SIZE[1]}x3 bytes")
+    return np.frombuffer(img_data, dtype=np.uint8).reshape(INPUT_SHAPE)
+
+
+def fill_input(buffer: np.ndarray, images: Sequence[np.ndarray]):
+    if buffer.dtype == np.float32:
+        for i, image in enumerate(images):
+            np.multiply(image, INPUT_SCALE, out=buffer[i], casting="unsafe")
+    else:
+        for i, image in enumerate(images):
+            buffer[i] = image
+
+
+def bucket_size(batch_size: int, buckets: Sequence[int]) -> int:
+    # Ближайший сверху размер из отсортированного buckets; батч крупнее всех идёт как есть
+    for bucket in buckets:
+        if bucket >= batch_size:
+            return bucket
+    return batch_size
+
+
+class InferenceSession:
+    def __init__(
+        self,
+        interpreter,
+        buckets: Sequence[int] = (),
+        load_interpreter: Callable[[], Any] | None = None,
+    ):
+        self.interpreter = interpreter
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        # Индексы и типы тензоров не меняются, запрашиваем их один раз при загрузке
+        self.input_index = input_details["index"]
+        self.output_index = output_details["index"]
+        self.input_dtype = input_details["dtype"]
+        self.input_shape = tuple(input_details["shape"])
+        # Интерпретатор держит одну форму входа, поэтому с load_interpreter на каждый размер из buckets
+        # заводится свой, с тензорами, выделенными под этот размер один раз
+        self.buckets = sorted(buckets)
+        self._load_interpreter = load_interpreter
+        self._interpreters: dict[int, Any] = {}
+
+    def _interpreter_for(self, shape: tuple):
+        if self._load_interpreter is None:
+            self._ensure_shape(shape)
+            return self.interpreter
+        interpreter = self._interpreters.get(shape[0])
+        if interpreter is None:
+            # Первый размер забирает уже загруженный интерпретатор
+            interpreter = self._load_interpreter() if self._interpreters else self.interpreter
+            interpreter.resize_tensor_input(self.input_index, shape)
+            interpreter.allocate_tensors()
+            self._interpreters[shape[0]] = interpreter
+        return interpreter
+
+    def _ensure_shape(self, shape: tuple):
+        # Размер батча меняется от вызова к вызову, перевыделяем тензоры только при смене формы
+        if self.input_shape != shape:
+            self.interpreter.resize_tensor_input(self.input_index, shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = shape
+
+    def predict(self, images: Sequence[np.ndarray], out: np.ndarray | None = None, record: bool = True) -> np.ndarray:
+        # Лишние строки дополненного батча остаются от прошлых вызовов: строки батча считаются
+        # независимо, и их выходы просто не читаются
+        interpreter = self._interpreter_for((bucket_size(len(images), self.buckets), *images[0].shape))
+
+        # Пишем картинки прямо в буфер входного тензора, без np.stack и set_tensor.
+        # Модель с uint8-входом сама делает препроцессинг в графе, для старой float-модели
+        # нормализуем на лету при копировании
+        with observe_stage("normalize", record):
+            input_buffer = interpreter.tensor(self.input_index)()
+            fill_input(input_buffer, images)
+            # Интерпретатор не даёт вызвать invoke(), пока живы numpy-представления его буферов
+            del input_buffer
+
+        with observe_stage("invoke", record):
+            interpreter.invoke()
+        if record:
+            BATCH_SIZE.observe(len(images))
+
+        if out is None:
+            out = np.empty(len(images), dtype=np.float32)
+        output_buffer = interpreter.tensor(self.output_index)()
+        out[:] = output_buffer[:len(images), 0]
+        del output_buffer
+        return out
+
+
+def warm_up(session, batch_sizes: Sequence[int]):
+    # Первые invoke() на каждом размере батча выделяют тензоры и готовят ядра XNNPACK,
+    # делаем это до того, как сервер объявит себя готовым
+    image = np.zeros(INPUT_SHAPE, dtype=np.uint8)
+    for batch_size in sorted(batch_sizes):
+        session.predict([image] * batch_size, record=False)
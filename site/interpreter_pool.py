@@ -0,0 +1,43 @@
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable
+
+
+class InterpreterPool:
+    def __init__(self, factory: Callable, size: int = 1):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(factory())
+        # Потоков ровно столько же, сколько сессий: задача в executor никогда не ждёт свободную
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="inference")
+
+    @property
+    def busy(self) -> int:
+        return self.size - self._idle.qsize()
+
+    @contextmanager
+    def acquire(self):
+        session = self._idle.get()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def for_each(self, fn: Callable, *args):
+        # Только пока пул не обслуживает запросы: все сессии лежат в очереди свободных
+        for session in list(self._idle.queue):
+            fn(session, *args)
+
+    def run(self, fn: Callable, *args):
+        with self.acquire() as session:
+            return fn(session, *args)
+
+    async def run_async(self, fn: Callable, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.run, fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,411 @@
+import asyncio
+import http.client
+import ipaddress
+import json
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Awaitable, Callable, Sequence
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from admission import Overloaded
+from inference import InvalidImage
+from metrics import JOBS_FINISHED
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    image BLOB,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    callback_url TEXT,
+    callback_state TEXT,
+    callback_attempts INTEGER NOT NULL DEFAULT 0,
+    callback_next_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_callbacks ON jobs (callback_state, callback_next_at);
+"""
+
+
+class JobStore:
+    # Очередь живёт в SQLite: принятые задания переживают перезапуск, а несколько процессов
+    # uvicorn делят одну очередь. Задание берётся в работу с арендой на lease_s секунд; если процесс
+    # упал посреди батча, аренда истекает и задание достаётся следующему
+    def __init__(self, path: str, lease_s: float = 60, max_attempts: int = 3):
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def submit(self, image: bytes, callback_url: str | None = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, created_at, image, callback_url) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, time.time(), image, callback_url),
+            )
+        return job_id
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, created_at, finished_at, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "finished_at": row["finished_at"],
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": row["error"],
+        }
+
+    def claim(self, limit: int) -> list[tuple[str, bytes]]:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Задание, которое уже max_attempts раз роняло свой процесс, больше не выдаём
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Too many attempts', finished_at = ?, image = NULL,"
+                    " callback_state = CASE WHEN callback_url IS NULL THEN NULL ELSE 'pending' END, callback_next_at = ?"
+                    " WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, now, self.max_attempts),
+                )
+                rows = self._db.execute(
+                    "SELECT id, image FROM jobs"
+                    " WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                    " ORDER BY created_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE jobs SET status = 'running', lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(now + self.lease_s, row["id"]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [(row["id"], row["image"]) for row in rows]
+
+    def finish(self, outcomes: Sequence[tuple[str, dict | None, str | None]]):
+        # outcomes: (id, результат, ошибка). Картинка после ответа больше не нужна и удаляется из базы
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, image = NULL, lease_until = NULL,"
+                " callback_state = CASE WHEN callback_url IS NULL THEN NULL ELSE 'pending' END, callback_next_at = ?"
+                " WHERE id = ?",
+                [
+                    ("failed" if error is not None else "done", json.dumps(result) if result is not None else None,
+                     error, now, now, job_id)
+                    for job_id, result, error in outcomes
+                ],
+            )
+
+    def release(self, job_ids: Sequence[str], error: str):
+        # Модель не смогла обработать батч: задания возвращаются в очередь (попытка уже засчитана),
+        # а исчерпавшие max_attempts завершаются с ошибкой
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, image = NULL, lease_until = NULL,"
+                " callback_state = CASE WHEN callback_url IS NULL THEN NULL ELSE 'pending' END, callback_next_at = ?"
+                " WHERE id = ? AND status = 'running' AND attempts >= ?",
+                [(error, now, now, job_id, self.max_attempts) for job_id in job_ids],
+            )
+            self._db.executemany(
+                "UPDATE jobs SET status = 'queued', lease_until = NULL WHERE id = ? AND status = 'running'",
+                [(job_id,) for job_id in job_ids],
+            )
+
+    def requeue(self, job_ids: Sequence[str]):
+        # Батч не взяли из-за перегрузки сервера: это не вина задания, попытка не засчитывается
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET status = 'queued', lease_until = NULL, attempts = attempts - 1"
+                " WHERE id = ? AND status = 'running'",
+                [(job_id,) for job_id in job_ids],
+            )
+
+    def due_callbacks(self, limit: int) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, status, result, error, callback_url, callback_attempts FROM jobs"
+                " WHERE callback_state = 'pending' AND callback_next_at <= ? ORDER BY callback_next_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def callback_attempted(self, job_id: str, state: str, next_at: float | None = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET callback_state = ?, callback_attempts = callback_attempts + 1, callback_next_at = ?"
+                " WHERE id = ?",
+                (state, next_at, job_id),
+            )
+
+    def prune(self, ttl: float) -> int:
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?"
+                " AND (callback_state IS NULL OR callback_state != 'pending')",
+                (time.time() - ttl,),
+            ).rowcount
+
+
+class InvalidCallbackUrl(ValueError):
+    pass
+
+
+def validate_callback_url(url: str, allowed_hosts: Sequence[str] = (), allow_private: bool = False) -> str | None:
+    # Возвращает проверенный адрес, к которому и надо подключаться: повторное разрешение имени
+    # при подключении могло бы вернуть уже внутренний адрес (DNS rebinding).
+    # Ошибка разрешения имени (OSError) пробрасывается как есть: при отправке колбэка она временная
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError as e:
+        raise InvalidCallbackUrl(f"callback_url is malformed: {e}") from e
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise InvalidCallbackUrl("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if allowed_hosts and host not in allowed_hosts:
+        raise InvalidCallbackUrl("callback_url host is not allowed")
+    if allow_private:
+        return None
+    # Проверяются все адреса имени: сервер не должен стучаться во внутреннюю сеть от имени клиента
+    addresses = [sockaddr[0] for *_, sockaddr in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)]
+    for raw_address in addresses:
+        address = ipaddress.ip_address(raw_address.split("%", 1)[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise InvalidCallbackUrl("callback_url must point to a public address")
+    return addresses[0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    # Подключается к заранее проверенному адресу, а Host остаётся исходным
+    def __init__(self, host: str, port: int, address: str, timeout: float):
+        super().__init__(host, port, timeout=timeout)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host: str, port: int, address: str, timeout: float):
+        super().__init__(host, port, timeout=timeout, context=ssl.create_default_context())
+        self.address = address
+
+    def connect(self):
+        # SNI и проверка сертификата - по исходному имени хоста
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def post_json(url: str, payload: dict, timeout: float, address: str | None = None) -> bool:
+    # Редиректы не выполняются: они увели бы колбэк на адрес в обход проверки
+    parts = urllib.parse.urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    connection_class = _PinnedHTTPSConnection if https else _PinnedHTTPConnection
+    connection = connection_class(parts.hostname, port, address or parts.hostname, timeout)
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+    try:
+        connection.request("POST", path, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        return 200 <= response.status < 300
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+
+class JobRunner:
+    def __init__(
+        self,
+        store: JobStore,
+        decode: Callable[[bytes], np.ndarray],
+        score_batch: Callable[[Sequence[np.ndarray]], Awaitable[list[dict]]],
+        batch_size: int = 16,
+        max_concurrent_batches: int = 1,
+        poll_interval: float = 1.0,
+        callback_timeout: float = 10.0,
+        callback_retries: int = 5,
+        callback_allowed_hosts: Sequence[str] = (),
+        callback_allow_private: bool = False,
+        result_ttl: float = 7 * 24 * 3600,
+    ):
+        self.store = store
+        self.decode = decode
+        self.score_batch = score_batch
+        self.batch_size = max(1, batch_size)
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.poll_interval = poll_interval
+        self.callback_timeout = callback_timeout
+        self.callback_retries = callback_retries
+        self.callback_allowed_hosts = callback_allowed_hosts
+        self.callback_allow_private = callback_allow_private
+        self.result_ttl = result_ttl
+        self._wakeup: asyncio.Event | None = None
+        self._callbacks_wakeup: asyncio.Event | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._batches: set[asyncio.Task] = set()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._callbacks_wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._deliver_callbacks())]
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Недоделанные батчи не ждём: их задания вернутся в очередь по истечении аренды
+        for task in self._batches:
+            task.cancel()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+    async def _wait(self, event: asyncio.Event, timeout: float):
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def _run(self):
+        while True:
+            # Из базы сразу берётся полный батч, и в работе не больше max_concurrent_batches таких батчей:
+            # остальные задания ждут в SQLite, а не в памяти батчера
+            await self._slots.acquire()
+            try:
+                jobs = await run_in_threadpool(self.store.claim, self.batch_size)
+            except BaseException:
+                self._slots.release()
+                raise
+            if not jobs:
+                self._slots.release()
+                await self._wait(self._wakeup, self.poll_interval)
+                continue
+            task = asyncio.create_task(self._process(jobs))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    def _decode_all(self, jobs: list[tuple[str, bytes]]) -> tuple[list[str], list[np.ndarray], list[tuple]]:
+        ids, arrays, rejected = [], [], []
+        for job_id, image in jobs:
+            try:
+                arrays.append(self.decode(image))
+                ids.append(job_id)
+            except InvalidImage as e:
+                rejected.append((job_id, None, str(e)))
+            except Exception as e:
+                # Неожиданная ошибка декодера валит только это задание, а не весь батч
+                print(f"❌ Ошибка декодирования задания {job_id}: {e}")
+                rejected.append((job_id, None, "Image could not be decoded"))
+        return ids, arrays, rejected
+
+    async def _process(self, jobs: list[tuple[str, bytes]]):
+        try:
+            ids, arrays, outcomes = await run_in_threadpool(self._decode_all, jobs)
+            if arrays:
+                try:
+                    results = await self.score_batch(arrays)
+                except Overloaded:
+                    await run_in_threadpool(self.store.requeue, ids)
+                    # Очередь bulk переполнена: даём ей рассосаться перед следующей попыткой
+                    await asyncio.sleep(self.poll_interval)
+                except Exception as e:
+                    print(f"❌ Ошибка обработки батча заданий: {e}")
+                    await run_in_threadpool(self.store.release, ids, str(e))
+                else:
+                    outcomes += [(job_id, result, None) for job_id, result in zip(ids, results)]
+            await run_in_threadpool(self.store.finish, outcomes)
+            for _, _, error in outcomes:
+                JOBS_FINISHED.labels("failed" if error is not None else "done").inc()
+            if outcomes:
+                self._callbacks_wakeup.set()
+        except Exception as e:
+            # Задания не висят в running до конца аренды, а сразу возвращаются в очередь
+            print(f"❌ Ошибка обработки батча заданий: {e}")
+            await run_in_threadpool(self.store.release, [job_id for job_id, _ in jobs], str(e))
+        finally:
+            self._slots.release()
+
+    def _post_callback(self, url: str, payload: dict) -> bool:
+        # Адрес проверяется и перед каждой отправкой: имя могло с тех пор начать указывать во внутреннюю сеть
+        try:
+            address = validate_callback_url(url, self.callback_allowed_hosts, self.callback_allow_private)
+        except OSError:
+            return False
+        return post_json(url, payload, self.callback_timeout, address)
+
+    async def _deliver_callbacks(self):
+        pruned_at = 0.0
+        while True:
+            if time.monotonic() - pruned_at > 3600:
+                pruned_at = time.monotonic()
+                await run_in_threadpool(self.store.prune, self.result_ttl)
+            for job in await run_in_threadpool(self.store.due_callbacks, 32):
+                payload = {
+                    "job_id": job["id"],
+                    "status": job["status"],
+                    "result": json.loads(job["result"]) if job["result"] is not None else None,
+                    "error": job["error"],
+                }
+                try:
+                    delivered = await run_in_threadpool(self._post_callback, job["callback_url"], payload)
+                except Exception as e:
+                    # Такой колбэк не доставить и повтором: помечаем его неудачным, остальные идут дальше
+                    print(f"❌ Колбэк задания {job['id']} не отправлен: {e}")
+                    await run_in_threadpool(self.store.callback_attempted, job["id"], "failed")
+                    continue
+                if delivered:
+                    await run_in_threadpool(self.store.callback_attempted, job["id"], "delivered")
+                elif job["callback_attempts"] + 1 >= self.callback_retries:
+                    await run_in_threadpool(self.store.callback_attempted, job["id"], "failed")
+                else:
+                    # Экспоненциальная пауза между повторами: 2, 4, 8... секунд
+                    next_at = time.time() + 2 ** (job["callback_attempts"] + 1)
+                    await run_in_threadpool(self.store.callback_attempted, job["id"], "pending", next_at)
+            await self._wait(self._callbacks_wakeup, self.poll_interval)
@@ -1,93 +1,525 @@
 import sys
 from pathlib import Path
 import uvicorn
-from fastapi import FastAPI, Request, File, UploadFile, HTTPException
+from fastapi import FastAPI, Request, File, Form, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from mako.template import Template
-from mako.lookup import TemplateLookup
-import tensorflow as tf
 import numpy as np
-from PIL import Image
-import io
 import os
 import uuid
+import asyncio
+import hmac
+import json
+import math
+import time
+import zipfile
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Sequence
 
+import config
+from admission import AdmissionMiddleware, Overloaded, QueueDelayShedder, TokenBuckets
+from batching import BatchClass, MicroBatcher
+from deadlines import (
+    ClientDisconnected,
+    Deadline,
+    DeadlineExceeded,
+    DeadlineMiddleware,
+    deadline_passed,
+    request_deadline,
+    until_disconnected,
+)
+from faqdata.faq_data import FAQ_ITEMS
+from http_cache import REVALIDATE, PageCache, StaticAssets
+from inference import InvalidImage, load_image, load_raw_rgb, tta_views
+from jobs import InvalidCallbackUrl, JobRunner, JobStore, validate_callback_url
+from metrics import (
+    DROPPED_WORK,
+    LatencyWindow,
+    POOL_UTILIZATION,
+    PREDICTIONS,
+    QUEUE_DEPTH,
+    REQUESTS_IN_FLIGHT,
+    TTA_RUNS,
+    observe_stage,
+    render_latest,
+)
+from model_manager import ModelManager, Prediction
+from prediction_cache import content_key, create_cache
+from uploads import UploadSizeLimitMiddleware, UploadTooLarge, read_limited, read_stream, read_upload
 
+
+RAW_RGB_CONTENT_TYPE = "application/x-mole-rgb"
+CLASS_THRESHOLDS = (0.266, 0.316)
 BASE_DIR = Path(__file__).parent
 STATIC_DIR = BASE_DIR / "static"
 TEMPLATES_DIR = BASE_DIR / "templates"
-interpreter = None
+models = ModelManager()
+model_load_error: str | None = None
+model_loading: asyncio.Task | None = None
+model_watcher: asyncio.Task | None = None
+inference_latency = LatencyWindow()
+
+
+def classify(prediction: float) -> int:
+    if prediction < CLASS_THRESHOLDS[0]:
+        return 0
+    if prediction < CLASS_THRESHOLDS[1]:
+        return 1
+    return 2
+
+
+def is_borderline(prediction: float) -> bool:
+    return any(abs(prediction - threshold) <= config.TTA_BAND for threshold in CLASS_THRESHOLDS)
+
+
+async def predict_batch_async(batch: Sequence[np.ndarray]) -> list[Prediction]:
+    started = time.perf_counter()
+    # Модель берётся в момент отправки батча: при горячей замене он доработает на старой
+    predictions = await models.current.predict_batch(batch)
+    inference_latency.observe(time.perf_counter() - started)
+    return predictions
 
 
-def predict_mole_tflite(image: Image.Image) -> float:
-    img = image.resize((260, 260))
-    img_array = np.array(img, dtype=np.float32) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
+def ensure_ready():
+    if models.current is None:
+        raise HTTPException(503, "Model is loading", headers={"Retry-After": "5"})
 
-    input_details = interpreter.get_input_details()
-    output_details = interpreter.get_output_details()
 
-    interpreter.set_tensor(input_details[0]["index"], img_array)
-    interpreter.invoke()
+async def score_array(img_array: np.ndarray, priority: str = "interactive", deadline: Deadline = None) -> dict:
+    try:
+        prediction = await batcher.submit(img_array, priority, deadline)
+        return await prediction_result(img_array, prediction, priority, deadline)
+    except Overloaded as e:
+        raise HTTPException(503, "Server is overloaded", headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+async def submit_all(img_arrays: Sequence[np.ndarray], priority: str, deadline: Deadline = None) -> list[Prediction]:
+    # Если одна картинка не прошла (очередь полна, срок истёк), остальные снимаются с очереди батчера,
+    # а не досчитываются впустую
+    tasks = [asyncio.ensure_future(batcher.submit(img_array, priority, deadline)) for img_array in img_arrays]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    prediction = interpreter.get_tensor(output_details[0]["index"])
-    return float(prediction[0][0])
+
+async def prediction_result(
+    img_array: np.ndarray,
+    prediction: Prediction,
+    priority: str = "interactive",
+    deadline: Deadline = None,
+) -> dict:
+    confidence, model_version = prediction
+    tta = config.TTA_ENABLED and is_borderline(confidence)
+    if tta:
+        TTA_RUNS.inc()
+        # Исходный ракурс уже посчитан. Остальные семь идут через батчер с тем же классом и сроком,
+        # поэтому подчиняются его очередям, лимитам и отбрасыванию наравне с обычными запросами
+        views = await submit_all(tta_views(img_array)[1:], priority, deadline)
+        confidence = float(np.mean([confidence, *(view.confidence for view in views)]))
+    return {
+        "class": classify(confidence),
+        "confidence": confidence,
+        "model_version": model_version,
+        "tta": tta,
+    }
+
+
+async def score_job_batch(img_arrays: Sequence[np.ndarray]) -> list[dict]:
+    # Задания уже собраны в полный батч и встают в очередь bulk целиком. Overloaded не превращается
+    # в HTTP-ответ: раннер вернёт задания в очередь, не засчитывая попытку, а уже поставленные
+    # картинки этого батча снимаются с очереди батчера
+    predictions = await submit_all(img_arrays, "bulk")
+    # TTA пограничных картинок батча идёт параллельно: их ракурсы попадают в одни батчи, а не по очереди
+    tasks = [
+        asyncio.ensure_future(prediction_result(img_array, prediction, "bulk"))
+        for img_array, prediction in zip(img_arrays, predictions)
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    for result in results:
+        PREDICTIONS.labels(str(result["class"])).inc()
+    return results
+
+
+async def score_image(img_data: bytes, priority: str = "interactive", deadline: Deadline = None) -> dict:
+    # Просроченную картинку не стоит и декодировать
+    if deadline_passed(deadline):
+        DROPPED_WORK.labels("deadline").inc()
+        raise DeadlineExceeded()
+    img_array = await run_in_threadpool(load_image, img_data)
+    return await score_array(img_array, priority, deadline)
+
+
+async def cached_prediction(
+    img_data: bytes,
+    compute: Callable[[Deadline], Awaitable[dict]],
+    deadline: float | None = None,
+) -> dict:
+    # compute общий для всех одинаковых запросов и получает их общий срок, самый поздний из сроков ждущих
+    key = content_key(img_data, models.current.version)
+    result = await prediction_cache.get_or_compute(key, compute, deadline)
+    PREDICTIONS.labels(str(result["class"])).inc()
+    return result
+
+
+def read_zip_member(zip_file: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    # file_size из архива может врать, поэтому лимит проверяется и при распаковке
+    if info.file_size > config.MAX_UPLOAD_BYTES:
+        raise UploadTooLarge("File is too large")
+    with zip_file.open(info) as member:
+        return read_limited(member, config.MAX_UPLOAD_BYTES)
+
+
+async def stream_predictions(sources: Iterable[tuple[str, Callable[[], bytes]]]) -> AsyncIterator[bytes]:
+    # В работе одновременно не больше BATCH_UPLOAD_CONCURRENCY картинок, поэтому память
+    # ограничена независимо от размера архива, а батчер всё равно получает полные батчи
+    limit = asyncio.Semaphore(config.BATCH_UPLOAD_CONCURRENCY)
+    done: asyncio.Queue = asyncio.Queue()
+    tasks: set[asyncio.Task] = set()
+
+    async def score(name: str, read: Callable[[], bytes]):
+        try:
+            with REQUESTS_IN_FLIGHT.track_inprogress():
+                with observe_stage("read"):
+                    img_data = await run_in_threadpool(read)
+                result = await cached_prediction(img_data, partial(score_image, img_data, "bulk"))
+            line = {"file": name, **result}
+        except (InvalidImage, UploadTooLarge) as e:
+            line = {"file": name, "status": "rejected", "message": str(e)}
+        except HTTPException as e:
+            # Картинку отбросила защита от перегрузки: её можно прислать повторно
+            line = {"file": name, "status": "overloaded", "message": e.detail}
+        except Exception as e:
+            line = {"file": name, "status": "error", "message": str(e)}
+        finally:
+            limit.release()
+        done.put_nowait(line)
+
+    pending = 0
+    try:
+        for name, read in sources:
+            await limit.acquire()
+            task = asyncio.create_task(score(name, read))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            pending += 1
+            while not done.empty():
+                pending -= 1
+                yield (json.dumps(done.get_nowait()) + "\n").encode()
+        while pending:
+            pending -= 1
+            yield (json.dumps(await done.get()) + "\n").encode()
+    finally:
+        # Клиент отключился: недоделанные картинки больше никому не нужны
+        for task in tasks:
+            task.cancel()
 
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
-templates = TemplateLookup(directories=[TEMPLATES_DIR])
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=config.MAX_UPLOAD_BYTES,
+    paths={"/check-mole", "/check-mole/raw", "/jobs"},
+)
+app.add_middleware(
+    AdmissionMiddleware,
+    paths={"/check-mole", "/check-mole/raw", "/check-mole/batch"},
+    overloaded=lambda: batcher.is_full,
+    retry_after=config.SHED_RETRY_AFTER_S,
+    buckets=TokenBuckets(config.CLIENT_RATE, config.CLIENT_BURST) if config.CLIENT_RATE > 0 else None,
+    client_header=config.CLIENT_ID_HEADER,
+)
+# Срок ответа отсчитывается самым внешним слоем, чтобы в него вошло и чтение тела
+app.add_middleware(
+    DeadlineMiddleware,
+    paths={"/check-mole", "/check-mole/raw"},
+    default_ms=config.REQUEST_TIMEOUT_MS,
+    header=config.REQUEST_TIMEOUT_HEADER,
+)
+static_assets = StaticAssets(STATIC_DIR)
+app.mount("/static", static_assets, name="static")
+# Страницы не зависят от запроса: рендерим их один раз в байты (и заново только после правки шаблонов),
+# а повторные заходы браузера закрываются ответом 304 по ETag
+pages = PageCache(TEMPLATES_DIR, {"static_url": static_assets.url, "faq_items": FAQ_ITEMS})
+batcher = MicroBatcher(
+    predict_batch_async,
+    classes=[
+        BatchClass(
+            "interactive",
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_delay_ms=config.BATCH_MAX_DELAY_MS,
+            max_queue_size=config.MAX_QUEUE_SIZE,
+            weight=config.INTERACTIVE_WEIGHT,
+            shedder=QueueDelayShedder(config.SHED_TARGET_MS, config.SHED_INTERVAL_MS),
+        ),
+        BatchClass(
+            "bulk",
+            max_batch_size=config.BULK_BATCH_MAX_SIZE,
+            max_delay_ms=config.BULK_BATCH_MAX_DELAY_MS,
+            max_queue_size=config.BULK_MAX_QUEUE_SIZE,
+            max_concurrent_batches=config.BULK_MAX_CONCURRENT_BATCHES,
+            weight=config.BULK_WEIGHT,
+            shedder=QueueDelayShedder(config.BULK_SHED_TARGET_MS, config.SHED_INTERVAL_MS)
+            if config.BULK_SHED_TARGET_MS > 0 else None,
+        ),
+    ],
+    policy=config.SCHEDULING_POLICY,
+    max_concurrent_batches=config.INFERENCE_PROCESSES or config.INTERPRETER_POOL_SIZE,
+    retry_after=config.SHED_RETRY_AFTER_S,
+)
+job_store = JobStore(config.JOBS_DB_PATH, lease_s=config.JOBS_LEASE_S, max_attempts=config.JOBS_MAX_ATTEMPTS)
+job_runner = JobRunner(
+    job_store,
+    decode=load_image,
+    score_batch=score_job_batch,
+    batch_size=config.JOBS_BATCH_SIZE,
+    max_concurrent_batches=config.JOBS_MAX_CONCURRENT_BATCHES,
+    poll_interval=config.JOBS_POLL_INTERVAL_S,
+    callback_timeout=config.JOBS_CALLBACK_TIMEOUT_S,
+    callback_retries=config.JOBS_CALLBACK_RETRIES,
+    callback_allowed_hosts=config.JOBS_CALLBACK_ALLOWED_HOSTS,
+    callback_allow_private=config.JOBS_CALLBACK_ALLOW_PRIVATE,
+    result_ttl=config.JOBS_RESULT_TTL_S,
+)
+prediction_cache = create_cache(
+    config.CACHE_BACKEND,
+    max_items=config.CACHE_MAX_ITEMS,
+    ttl=config.CACHE_TTL_S,
+    redis_url=config.CACHE_REDIS_URL,
+)
+
+
+async def load_model():
+    global model_load_error, model_watcher
+    try:
+        model = await models.reload()
+    except Exception as e:
+        print(f"❌ Ошибка загрузки модели: {e}")
+        model_load_error = str(e)
+        return
+    print(f"✅ Модель {model.version} загружена и прогрета, бэкенд {model.backend}")
+    # Задания, принятые пока модель грузилась (или до перезапуска), начинают разбираться только теперь
+    job_runner.start()
+    if config.MODEL_WATCH_INTERVAL_S > 0:
+        model_watcher = asyncio.create_task(models.watch(config.MODEL_WATCH_INTERVAL_S))
 
 
 @app.on_event("startup")
 async def load_model_on_startup():
-    import get_model
+    # Модель грузится и прогревается в фоне: /healthz отвечает сразу, а трафик
+    # балансировщик пустит только после того, как /readyz станет 200
+    global model_loading
+    for page in ("main_page.mako", "analyze.mako", "faq.mako"):
+        pages.get(page)
+    batcher.start()
+    model_loading = asyncio.create_task(load_model())
+
+    for batch_class in batcher.classes.values():
+        QUEUE_DEPTH.labels(batch_class.name).set_function(lambda queue=batch_class.queue: len(queue))
+    POOL_UTILIZATION.set_function(lambda: models.current.utilization if models.current is not None else 0)
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    for task in (model_loading, model_watcher):
+        if task is not None and not task.done():
+            task.cancel()
+    await job_runner.stop()
+    await batcher.stop()
+    await models.close()
+    job_store.close()
+
 
-    global interpreter
-    interpreter = get_model.try_load_model()
+@app.get("/healthz")
+async def healthz():
+    if model_load_error is not None:
+        return JSONResponse({"status": "error", "message": model_load_error}, status_code=503)
+    # Умерший процесс инференса сам не поднимется: нужен перезапуск, а не только вывод из балансировки
+    if models.current is not None and models.current.error is not None:
+        return JSONResponse({"status": "error", "message": models.current.error}, status_code=503)
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    p50 = inference_latency.percentile(0.5)
+    p95 = inference_latency.percentile(0.95)
+    model = models.current
+    body = {
+        "status": "ready" if model is not None else "loading",
+        "model_version": model.version if model is not None else None,
+        "backend": model.backend if model is not None else None,
+        "inference_p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+        "inference_p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+    }
+    if model is None:
+        return JSONResponse(body, status_code=503)
+    if model.error is not None:
+        body["status"] = "error"
+        body["message"] = model.error
+        return JSONResponse(body, status_code=503)
+    if config.READY_MAX_P95_MS and p95 is not None and p95 * 1000 > config.READY_MAX_P95_MS:
+        body["status"] = "overloaded"
+        return JSONResponse(body, status_code=503)
+    return body
 
 
 @app.get("/", response_class=HTMLResponse)
 async def main_page(request: Request):
-    return templates.get_template("main_page.mako").render()
+    return pages.get("main_page.mako").response(request.headers, REVALIDATE)
 
 
 @app.get("/analyze", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.get_template("analyze.mako").render()
+    return pages.get("analyze.mako").response(request.headers, REVALIDATE)
 
 
 @app.post("/check-mole")
-async def check_mole(file: UploadFile = File(...)):
+async def check_mole(request: Request, file: UploadFile = File(...)):
+    deadline = request_deadline(request)
     try:
+        ensure_ready()
         if not file.content_type.startswith("image/"):
             raise HTTPException(400, "Only images allowed")
 
-        img_data = await file.read()
-        img = Image.open(io.BytesIO(img_data))
-        if img.mode in ("RGBA", "LA"):
-            img = img.convert("RGB")
-        prediction = predict_mole_tflite(img)
-        if prediction < 0.266:
-            class_idx = 0
-        elif prediction < 0.316:
-            class_idx = 1
-        else:
-            class_idx = 2
+        with REQUESTS_IN_FLIGHT.track_inprogress():
+            with observe_stage("read"):
+                img_data = await read_upload(file, config.MAX_UPLOAD_BYTES)
+            return await until_disconnected(
+                request, cached_prediction(img_data, partial(score_image, img_data, "interactive"), deadline)
+            )
 
-        return {"class": int(class_idx), "confidence": float(prediction)}
+    except HTTPException:
+        raise
+    except InvalidImage as e:
+        raise HTTPException(400, str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(504, str(e))
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+@app.post("/check-mole/raw")
+async def check_mole_raw(request: Request):
+    # Тело запроса - сама картинка без multipart. С Content-Type application/x-mole-rgb
+    # это уже готовые 260x260x3 байта RGB, и декодирование с ресайзом пропускаются
+    raw_rgb = request.headers.get("content-type", "").startswith(RAW_RGB_CONTENT_TYPE)
+    deadline = request_deadline(request)
+    try:
+        ensure_ready()
+        with REQUESTS_IN_FLIGHT.track_inprogress():
+            with observe_stage("read"):
+                img_data = await read_stream(request.stream(), config.MAX_UPLOAD_BYTES, check_format=not raw_rgb)
+            if raw_rgb:
+                img_array = load_raw_rgb(img_data)
+                compute = partial(score_array, img_array, "interactive")
+            else:
+                compute = partial(score_image, img_data, "interactive")
+            return await until_disconnected(request, cached_prediction(img_data, compute, deadline))
 
+    except HTTPException:
+        raise
+    except InvalidImage as e:
+        raise HTTPException(400, str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(504, str(e))
+    except ClientDisconnected:
+        return Response(status_code=499)
     except Exception as e:
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
 
+@app.post("/check-mole/batch")
+async def check_mole_batch(
+    files: list[UploadFile] | None = File(None),
+    archive: UploadFile | None = File(None),
+):
+    ensure_ready()
+    sources = [(file.filename, partial(read_limited, file.file, config.MAX_UPLOAD_BYTES)) for file in files or []]
+    if archive is not None:
+        try:
+            zip_file = await run_in_threadpool(zipfile.ZipFile, archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(400, "Archive is not a valid zip file")
+        sources += [
+            (info.filename, partial(read_zip_member, zip_file, info))
+            for info in zip_file.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        ]
+    if not sources:
+        raise HTTPException(400, "No images uploaded")
+
+    return StreamingResponse(stream_predictions(sources), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), callback_url: str | None = Form(None)):
+    # Ответ приходит сразу с id задания, результат забирается через GET /jobs/{id}
+    # или приходит POST-запросом на callback_url
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(400, "Only images allowed")
+    if callback_url is not None:
+        try:
+            await run_in_threadpool(
+                validate_callback_url,
+                callback_url,
+                config.JOBS_CALLBACK_ALLOWED_HOSTS,
+                config.JOBS_CALLBACK_ALLOW_PRIVATE,
+            )
+        except InvalidCallbackUrl as e:
+            raise HTTPException(400, str(e))
+        except OSError:
+            raise HTTPException(400, "callback_url host cannot be resolved")
+    img_data = await read_upload(file, config.MAX_UPLOAD_BYTES)
+    if await run_in_threadpool(job_store.pending_count) >= config.JOBS_MAX_PENDING:
+        raise HTTPException(503, "Job queue is full", headers={"Retry-After": "60"})
+    job_id = await run_in_threadpool(job_store.submit, img_data, callback_url)
+    job_runner.wake()
+    return JSONResponse(
+        {"job_id": job_id, "status": "queued"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
 @app.get("/faq", response_class=HTMLResponse)
 async def faq_page(request: Request):
-    from faqdata.faq_data import FAQ_ITEMS
+    return pages.get("faq.mako").response(request.headers, REVALIDATE)
+
+
+@app.post("/admin/reload-model")
+async def reload_model(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not config.ADMIN_TOKEN or not hmac.compare_digest(token, config.ADMIN_TOKEN):
+        raise HTTPException(403, "Forbidden")
+    try:
+        model = await models.reload()
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+    return {"status": "ok", "model_version": model.version}
+
 
-    return templates.get_template("faq.mako").render(faq_items=FAQ_ITEMS)
+@app.get("/metrics")
+async def metrics():
+    content, media_type = render_latest()
+    return Response(content, media_type=media_type)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STAGE_SECONDS = Histogram(
+    "mole_stage_seconds",
+    "Time spent in each stage of a prediction request",
+    ["stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    "mole_batch_size",
+    "Number of images per model invocation",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+REQUESTS_IN_FLIGHT = Gauge("mole_requests_in_flight", "Prediction requests currently being processed")
+QUEUE_DEPTH = Gauge("mole_batch_queue_depth", "Images waiting in the micro-batcher queue", ["priority"])
+POOL_UTILIZATION = Gauge("mole_interpreter_pool_utilization", "Share of interpreters currently running a batch")
+PREDICTIONS = Counter("mole_predictions_total", "Predictions returned to clients by class", ["class_idx"])
+SHED_REQUESTS = Counter("mole_shed_requests_total", "Requests rejected by admission control", ["reason"])
+DROPPED_WORK = Counter(
+    "mole_dropped_work_total",
+    "Queued images dropped before inference because the deadline passed or the client went away",
+    ["reason"],
+)
+TTA_RUNS = Counter("mole_tta_runs_total", "Borderline predictions re-scored with test-time augmentation")
+JOBS_FINISHED = Counter("mole_jobs_finished_total", "Asynchronous jobs finished by outcome", ["outcome"])
+
+
+@contextmanager
+def observe_stage(stage: str, record: bool = True):
+    # record=False - прогрев и замеры бэкендов, которые не должны попадать в гистограммы обслуживания
+    if not record:
+        yield
+        return
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage, outcome).observe(time.perf_counter() - started)
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 256):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def render_latest() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
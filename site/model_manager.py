@@ -0,0 +1,190 @@
+import asyncio
+import os
+from typing import NamedTuple, Sequence
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+import backends
+import config
+import get_model
+from inference import warm_up
+from interpreter_pool import InterpreterPool
+from metrics import observe_stage
+from shm_workers import ShmInferenceWorkers
+
+
+class Prediction(NamedTuple):
+    confidence: float
+    model_version: str
+
+
+class LoadedModel:
+    def __init__(
+        self,
+        version: str,
+        backend: str,
+        pool: InterpreterPool | None = None,
+        workers: ShmInferenceWorkers | None = None,
+    ):
+        self.version = version
+        self.backend = backend
+        self.pool = pool
+        self.workers = workers
+        self.active = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    @property
+    def error(self) -> str | None:
+        return self.workers.failed if self.workers is not None else None
+
+    @property
+    def utilization(self) -> float:
+        if self.workers is not None:
+            return self.workers.busy / self.workers.processes
+        return self.pool.busy / self.pool.size
+
+    async def predict_batch(self, batch: Sequence[np.ndarray]) -> list[Prediction]:
+        self.active += 1
+        self._drained.clear()
+        try:
+            if self.workers is not None:
+                # invoke() идёт в другом процессе, здесь видно только время всего похода туда и обратно
+                with observe_stage("invoke"):
+                    values = await self.workers.predict_batch(batch)
+            else:
+                values = await self.pool.run_async(backends.predict, batch)
+        finally:
+            self.active -= 1
+            if self.active == 0:
+                self._drained.set()
+        return [Prediction(float(value), self.version) for value in values]
+
+    async def close(self):
+        # Батчи, уже отправленные в эту модель, дорабатывают на ней
+        await self._drained.wait()
+        if self.workers is not None:
+            await run_in_threadpool(self.workers.stop)
+        if self.pool is not None:
+            await run_in_threadpool(self.pool.shutdown)
+
+
+_chosen_backend: str | None = None
+
+
+def choose_backend() -> str:
+    global _chosen_backend
+    if config.INFERENCE_BACKEND != "auto":
+        return config.INFERENCE_BACKEND
+    candidates = backends.available_backends()
+    if len(candidates) == 1:
+        return candidates[0]
+    # Скорость замеряется один раз, при первой загрузке: при горячей замене замер шёл бы на тех же ядрах,
+    # что и трафик. Новой модели достаточно совпасть с эталоном на уже выбранном бэкенде
+    if _chosen_backend in candidates and (
+        _chosen_backend == candidates[0]
+        or backends.check_backend(
+            _chosen_backend,
+            candidates[0],
+            num_threads=config.INTERPRETER_NUM_THREADS,
+            tolerance=config.BACKEND_TOLERANCE,
+        )
+    ):
+        return _chosen_backend
+    _chosen_backend = backends.select_backend(
+        candidates,
+        num_threads=config.INTERPRETER_NUM_THREADS,
+        batch_size=config.BATCH_MAX_SIZE,
+        repeats=config.BACKEND_BENCH_REPEATS,
+        tolerance=config.BACKEND_TOLERANCE,
+    )
+    return _chosen_backend
+
+
+async def load_model() -> LoadedModel:
+    version = await run_in_threadpool(get_model.model_version)
+    backend = await run_in_threadpool(choose_backend)
+    if config.INFERENCE_PROCESSES > 0:
+        workers = ShmInferenceWorkers(
+            config.INFERENCE_PROCESSES,
+            # Кольцо рассчитано на самый крупный батч из всех классов батчера, иначе батч bulk в него не влезет
+            max_batch_size=config.MAX_BATCH_SIZE,
+            num_threads=config.INTERPRETER_NUM_THREADS,
+            batch_buckets=config.BATCH_BUCKETS,
+            backend=backend,
+        )
+        try:
+            await workers.start()
+        except BaseException:
+            # В том числе отмена на остановке сервера посреди перезагрузки. Процессы ждут
+            # до 10 секунд каждый, поэтому не в цикле событий
+            await run_in_threadpool(workers.stop)
+            raise
+        return LoadedModel(version, backend, workers=workers)
+
+    pool = await run_in_threadpool(
+        InterpreterPool,
+        lambda: backends.load_session(backend, config.INTERPRETER_NUM_THREADS, config.BATCH_BUCKETS),
+        config.INTERPRETER_POOL_SIZE,
+    )
+    await run_in_threadpool(pool.for_each, warm_up, config.BATCH_BUCKETS)
+    return LoadedModel(version, backend, pool=pool)
+
+
+def model_file_state() -> tuple | None:
+    states = []
+    for path in get_model.MODEL_FILES:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            states.append(None)
+            continue
+        states.append((stat.st_mtime_ns, stat.st_size))
+    if states[0] is None:
+        return None
+    return tuple(states)
+
+
+class ModelManager:
+    def __init__(self):
+        self.current: LoadedModel | None = None
+        self._lock = asyncio.Lock()
+        self._retiring: set[asyncio.Task] = set()
+
+    async def reload(self) -> LoadedModel:
+        # Новая модель грузится и прогревается, пока старая обслуживает запросы,
+        # затем ссылка подменяется одним присваиванием
+        async with self._lock:
+            model = await load_model()
+            previous, self.current = self.current, model
+        if previous is not None:
+            task = asyncio.create_task(previous.close())
+            self._retiring.add(task)
+            task.add_done_callback(self._retiring.discard)
+        return model
+
+    async def watch(self, interval: float):
+        state = model_file_state()
+        while True:
+            await asyncio.sleep(interval)
+            new_state = model_file_state()
+            if new_state is None or new_state == state:
+                continue
+            # Файл ещё может дописываться, ждём, пока он перестанет меняться
+            await asyncio.sleep(interval)
+            if model_file_state() != new_state:
+                continue
+            state = new_state
+            try:
+                model = await self.reload()
+                print(f"✅ Модель обновлена до версии {model.version}")
+            except Exception as e:
+                print(f"❌ Ошибка перезагрузки модели, остаётся прежняя: {e}")
+
+    async def close(self):
+        if self._retiring:
+            await asyncio.gather(*self._retiring, return_exceptions=True)
+        if self.current is not None:
+            await self.current.close()
+            self.current = None
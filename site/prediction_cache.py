@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Awaitable, Callable
+
+from deadlines import DeadlineExceeded, SharedDeadline
+from metrics import DROPPED_WORK
+
+
+def content_key(data: bytes, model_version: str) -> str:
+    return f"{model_version}:{hashlib.blake2b(data, digest_size=16).hexdigest()}"
+
+
+class MemoryCache:
+    def __init__(self, max_items: int = 1024, ttl: float = 3600):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    async def get(self, key: str) -> dict | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+
+class RedisCache:
+    def __init__(self, url: str, ttl: float = 3600, prefix: str = "mr-mole:prediction:"):
+        import redis.asyncio as redis
+
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str) -> dict | None:
+        # Недоступный Redis не должен ронять предсказания, просто идём в модель
+        try:
+            raw = await self._client.get(self.prefix + key)
+        except Exception:
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: dict):
+        try:
+            await self._client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except Exception:
+            pass
+
+
+class PredictionCache:
+    def __init__(self, backend: MemoryCache | RedisCache | None = None):
+        self.backend = backend
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self._deadlines: dict[str, SharedDeadline] = {}
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[SharedDeadline], Awaitable[dict]],
+        deadline: float | None = None,
+    ) -> dict:
+        if self.backend is not None:
+            cached = await self.backend.get(key)
+            if cached is not None:
+                return cached
+
+        # Одинаковые загрузки, пришедшие одновременно, ждут один и тот же инференс
+        task = self._inflight.get(key)
+        if task is None:
+            shared_deadline = SharedDeadline(deadline)
+            task = asyncio.create_task(self._compute(key, compute, shared_deadline))
+            self._inflight[key] = task
+            self._deadlines[key] = shared_deadline
+            task.add_done_callback(partial(self._forget, key))
+        else:
+            # Срок общего инференса - самый поздний из сроков ждущих: срок первого запроса
+            # не обрывает тех, кто пришёл позже с запасом
+            self._deadlines[key].extend(deadline)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Каждый ждущий при этом отвечает не позже своего срока
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if not done:
+                DROPPED_WORK.labels("deadline").inc()
+                raise DeadlineExceeded()
+            return task.result()
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                # Все, кто ждал этот инференс, ушли (клиенты отключились или сроки истекли): отменяем его,
+                # и картинка выпадет из очереди батчера, не дойдя до модели
+                if not task.done():
+                    self._forget(key, task)
+                    task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._deadlines[key]
+
+    async def _compute(
+        self,
+        key: str,
+        compute: Callable[[SharedDeadline], Awaitable[dict]],
+        deadline: SharedDeadline,
+    ) -> dict:
+        result = await compute(deadline)
+        if self.backend is not None:
+            await self.backend.set(key, result)
+        return result
+
+
+def create_cache(backend: str, max_items: int, ttl: float, redis_url: str) -> PredictionCache:
+    if backend == "memory":
+        return PredictionCache(MemoryCache(max_items=max_items, ttl=ttl))
+    if backend == "redis":
+        return PredictionCache(RedisCache(redis_url, ttl=ttl))
+    if backend == "none":
+        return PredictionCache()
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Sequence
+
+import numpy as np
+
+from inference import INPUT_SHAPE, warm_up
+
+
+# Как часто поток чтения результатов проверяет, что процессы инференса живы
+LIVENESS_CHECK_INTERVAL_S = 1.0
+
+class SharedSlots:
+    def __init__(self, slots: int, shape: tuple = INPUT_SHAPE, name: str | None = None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        image_size = int(np.prod(self.shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * (image_size + 4))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # Входы и выходы лежат в одном сегменте: [slots x H x W x 3 uint8][slots float32]
+        self.inputs = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=self.shm.buf)
+        self.outputs = np.ndarray((slots,), dtype=np.float32, buffer=self.shm.buf, offset=slots * image_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self, unlink: bool = False):
+        if self.inputs is None:
+            return
+        # Numpy-представления держат буфер, без их удаления SharedMemory.close() падает
+        self.inputs = self.outputs = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker_main(
+    shm_name: str,
+    slots: int,
+    shape: tuple,
+    tasks,
+    results,
+    num_threads: int | None,
+    batch_buckets: Sequence[int],
+    backend: str,
+):
+    import backends
+
+    ring = SharedSlots(slots, shape, name=shm_name)
+    try:
+        session = backends.load_session(backend, num_threads, batch_buckets)
+        warm_up(session, batch_buckets)
+    except Exception as e:
+        results.put((None, str(e)))
+        ring.close()
+        return
+    results.put((None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, indices = task
+        try:
+            ring.outputs[indices] = session.predict([ring.inputs[i] for i in indices])
+            results.put((task_id, None))
+        except Exception as e:
+            results.put((task_id, str(e)))
+    ring.close()
+
+
+class ShmInferenceWorkers:
+    def __init__(
+        self,
+        processes: int,
+        max_batch_size: int,
+        num_threads: int | None = None,
+        batch_buckets: Sequence[int] = (),
+        backend: str = "tflite",
+    ):
+        ctx = mp.get_context("spawn")
+        self.processes = max(1, processes)
+        # С запасом в два батча на процесс: батчер не отправляет больше одного батча на процесс
+        self.ring = SharedSlots(self.processes * max_batch_size * 2)
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._free = deque(range(self.ring.slots))
+        self._pending: dict[int, tuple[asyncio.Future, list[int]]] = {}
+        self._ids = itertools.count()
+        self._stopping = False
+        self.failed: str | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._reader: threading.Thread | None = None
+        self._workers = [
+            ctx.Process(
+                target=_worker_main,
+                args=(
+                    self.ring.name,
+                    self.ring.slots,
+                    self.ring.shape,
+                    self._tasks,
+                    self._results,
+                    num_threads,
+                    tuple(batch_buckets),
+                    backend,
+                ),
+                daemon=True,
+            )
+            for _ in range(self.processes)
+        ]
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            worker.start()
+        error = await self._loop.run_in_executor(None, self._wait_ready)
+        if error is not None:
+            await self._loop.run_in_executor(None, self.stop)
+            raise RuntimeError(f"Inference worker failed to load model: {error}")
+        self._reader = threading.Thread(target=self._read_results, name="shm-results", daemon=True)
+        self._reader.start()
+
+    def _wait_ready(self) -> str | None:
+        ready = 0
+        while ready < len(self._workers):
+            try:
+                _, error = self._results.get(timeout=LIVENESS_CHECK_INTERVAL_S)
+            except queue.Empty:
+                # Процесс, упавший при загрузке модели (segfault, OOM в делегате), не пришлёт ни успеха, ни ошибки
+                if not all(worker.is_alive() for worker in self._workers):
+                    return "Inference worker process died"
+                continue
+            if error is not None:
+                return error
+            ready += 1
+        return None
+
+    def stop(self):
+        # Повторный вызов (после неудачного start() и ещё раз из load_model) ничего не делает
+        if self._stopping:
+            return
+        self._stopping = True
+        # Сегмент удаляется в любом случае, даже если остановка процессов упала
+        try:
+            # Процессы, до которых start() не дошёл, не запускались: join() для них падает
+            started = [worker for worker in self._workers if worker.pid is not None]
+            for _ in started:
+                self._tasks.put(None)
+            for worker in started:
+                worker.join(timeout=10)
+                if worker.is_alive():
+                    worker.terminate()
+            if self._reader is not None:
+                self._results.put(None)
+                self._reader.join()
+                self._reader = None
+        finally:
+            self.ring.close(unlink=True)
+
+    @property
+    def busy(self) -> int:
+        return len(self._pending)
+
+    async def predict_batch(self, batch: Sequence[np.ndarray]) -> np.ndarray:
+        if self.failed is not None:
+            raise RuntimeError(self.failed)
+        if len(batch) > len(self._free):
+            raise RuntimeError("No free shared memory slots for the batch")
+        indices = [self._free.popleft() for _ in range(len(batch))]
+        for index, image in zip(indices, batch):
+            self.ring.inputs[index] = image
+        task_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[task_id] = (future, indices)
+        self._tasks.put((task_id, indices))
+        return await future
+
+    def _read_results(self):
+        while True:
+            try:
+                message = self._results.get(timeout=LIVENESS_CHECK_INTERVAL_S)
+            except queue.Empty:
+                # Процесс, убитый OOM или упавший в делегате, ответа уже не пришлёт:
+                # без этой проверки его батч ждал бы вечно и держал слот батчера
+                if not self._stopping and self.failed is None and not all(w.is_alive() for w in self._workers):
+                    self._loop.call_soon_threadsafe(self._fail_pending, "Inference worker process died")
+                continue
+            if message is None:
+                break
+            self._loop.call_soon_threadsafe(self._complete, *message)
+
+    def _fail_pending(self, error: str):
+        # Какой процесс взял какой батч, неизвестно, поэтому отказывают все ждущие батчи и все новые.
+        # Слоты не освобождаются: живой процесс ещё может дописать в них свой результат
+        self.failed = error
+        pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(error))
+
+    def _complete(self, task_id: int, error: str | None):
+        entry = self._pending.pop(task_id, None)
+        if entry is None:
+            return
+        future, indices = entry
+        values = self.ring.outputs[indices]
+        self._free.extend(indices)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(values)
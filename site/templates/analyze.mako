@@ -46,5 +46,5 @@
 
 <%def name="scripts()">
     ${parent.scripts()}
-    <script src="/static/scripts/analyze.js"></script>
+    <script src="${static_url('scripts/analyze.js')}"></script>
 </%def>
\ No newline at end of file
@@ -4,13 +4,13 @@
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>${self.title()}</title>
-    <link rel="icon" href="/static/logo/logo.png" type="image/png">
-    <link rel="stylesheet" href="/static/css_content/all_styles.css">
+    <link rel="icon" href="${static_url('logo/logo.png')}" type="image/png">
+    <link rel="stylesheet" href="${static_url('css_content/all_styles.css')}">
 </head>
 <body>
     <header class="header">
         <div class="logo-container">
-        <img src="/static/logo/logo.png" alt="Mr.Mole Logo" class="logo-img">
+        <img src="${static_url('logo/logo.png')}" alt="Mr.Mole Logo" class="logo-img">
         <span class="logo-text">Mr.Mole</span>
         </div>
         <nav class="nav-links">
@@ -44,5 +44,5 @@ Mr.Mole - ${self.page_title()}
 </%def>
 
 <%def name="scripts()">
-    <script src="/static/scripts/nav.js"></script>
+    <script src="${static_url('scripts/nav.js')}"></script>
 </%def>
\ No newline at end of file
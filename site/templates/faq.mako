@@ -21,5 +21,5 @@ Image Processor - FAQ
 
 <%def name="scripts()">
     ${parent.scripts()}
-    <script src="/static/scripts/faq.js"></script>
+    <script src="${static_url('scripts/faq.js')}"></script>
 </%def>
\ No newline at end of file
@@ -0,0 +1,117 @@
+from typing import AsyncIterator, BinaryIO
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Запас на заголовки multipart поверх самого файла
+MULTIPART_OVERHEAD = 16 * 1024
+
+# Самая длинная сигнатура — WEBP: RIFF, 4 байта размера, WEBP
+SNIFF_BYTES = 12
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+    b"BM": "BMP",
+}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def sniff_image_format(head: bytes) -> str | None:
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+async def read_stream(chunks: AsyncIterator[bytes], max_bytes: int, check_format: bool = True) -> bytes:
+    # Формат проверяем по первым байтам, остальное читаем только для настоящих картинок
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        if check_format and size < SNIFF_BYTES <= size + len(chunk):
+            if sniff_image_format(b"".join(parts) + chunk) is None:
+                raise HTTPException(415, "Unsupported image format")
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(413, "File is too large")
+        parts.append(chunk)
+
+    data = b"".join(parts)
+    if check_format and size < SNIFF_BYTES and sniff_image_format(data) is None:
+        raise HTTPException(415, "Unsupported image format")
+    return data
+
+
+async def iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    return await read_stream(iter_upload(file), max_bytes)
+
+
+def read_limited(fileobj: BinaryIO, max_bytes: int) -> bytes:
+    data = fileobj.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadTooLarge("File is too large")
+    return data
+
+
+class UploadSizeLimitMiddleware:
+    def __init__(self, app, max_bytes: int, paths: set[str]):
+        self.app = app
+        self.max_bytes = max_bytes + MULTIPART_OVERHEAD
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # Отказываем по Content-Length ещё до того, как multipart-парсер начнёт читать тело
+        too_large = JSONResponse({"detail": "File is too large"}, status_code=413)
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await too_large(scope, receive, send)
+                return
+
+        # У chunked-загрузки Content-Length нет, поэтому байты тела считаются по мере чтения:
+        # иначе multipart-парсер успел бы сложить на диск всё, что пришлёт клиент
+        received = 0
+        started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    if not started and not rejected:
+                        rejected = True
+                        await too_large(scope, receive, send)
+                    raise UploadTooLarge("File is too large")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # После нашего 413 ответ приложения (например, 400 от парсера тела) уже не отправляется
+            if not rejected:
+                started = True
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not rejected:
+                raise